@@ -0,0 +1,82 @@
+"""Compare WARC compression codecs/levels: ratio and speed (MB/s)
+
+Usage: python benchmarks/compression.py <warc-filename> [<warc-filename> ...]
+
+All records from the given WARCs are loaded into memory and written again
+with each compression setting. `zstd+dict` uses a dictionary trained on the
+records themselves (a best case: a real dictionary is trained on a sample).
+"""
+
+import io
+import sys
+import time
+
+from warcio.archiveiterator import ArchiveIterator
+
+from crau.warc import WarcWriter, import_zstd, iter_records
+
+SETTINGS = [
+    ("none", None),
+    ("gzip", 1),
+    ("gzip", 6),
+    ("gzip", 9),
+    ("zstd", 1),
+    ("zstd", 3),
+    ("zstd", 9),
+    ("zstd", 19),
+    ("zstd+dict", 3),
+    ("zstd+dict", 19),
+]
+
+
+def load_records(filenames):
+    """Return uncompressed WARC records (as bytes) from `filenames`"""
+    records = []
+    for record in iter_records(filenames):
+        data = io.BytesIO()
+        WarcWriter(data, compression="none").write_record(record)
+        records.append(data.getvalue())
+    return records
+
+
+def write_records(records, compression, level, dictionary=None):
+    """Return elapsed time and size to write `records` with these settings"""
+    parsed = [next(ArchiveIterator(io.BytesIO(record))) for record in records]
+    output = io.BytesIO()
+    start = time.perf_counter()
+    writer = WarcWriter(
+        output, compression=compression, level=level, dictionary=dictionary
+    )
+    for record in parsed:
+        writer.write_record(record)
+    return time.perf_counter() - start, output.tell()
+
+
+def main():
+    records = load_records(sys.argv[1:])
+    total = sum(len(record) for record in records)
+    try:
+        zstd = import_zstd()
+    except RuntimeError:
+        zstd = None
+
+    print(f"{len(records)} records, {total / 1024 / 1024:.2f} MiB uncompressed")
+    print(f"{'compression':<12} {'level':>5} {'ratio':>7} {'MB/s':>8}")
+    for compression, level in SETTINGS:
+        dictionary = None
+        if compression.startswith("zstd"):
+            if zstd is None:
+                continue
+            elif compression == "zstd+dict":
+                dictionary = zstd.train_dict(records, 64 * 1024).dict_content
+        elapsed, size = write_records(
+            records, compression.split("+")[0], level, dictionary
+        )
+        print(
+            f"{compression:<12} {level or '-':>5} {total / size:7.2f} "
+            f"{total / 1000 / 1000 / elapsed:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
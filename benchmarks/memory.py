@@ -0,0 +1,115 @@
+"""Compare memory used by queued requests: bytes per request (tracemalloc)
+
+Usage: python benchmarks/memory.py [<pages> [<links-per-page>]]
+
+Requests are created as if `<links-per-page>` links were found on each page
+and pushed to the scheduler's priority queue configured by `CrauSpider`
+(`DownloaderAwarePriorityQueue`, with in-memory downstream queues), using the
+previous request metadata (a `meta` dict with 4 keys per request) and the
+current one (a `CrauRequest` slot pointing to the `RequestInfo` shared by the
+requests found in the same page). The queue reads each request's `meta` (to
+get its downloader slot), which creates an empty dict for requests without
+it. Part of the remaining bytes are allocated by scrapy itself (`Headers`,
+`cookies`, `flags`, the instance `__dict__` and its live references
+tracking).
+"""
+
+import gc
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.core.downloader import Downloader
+from scrapy.utils.misc import create_instance, load_object
+from scrapy.utils.test import get_crawler
+
+from crau.spider import CrauRequest, CrauSpider, RequestInfo
+
+
+def legacy_requests(spider, pages):
+    requests = []
+    for main_url, urls in pages:
+        for url in urls:
+            requests.append(
+                Request(
+                    url,
+                    callback=spider.parse,
+                    errback=spider.parse_request_error,
+                    dont_filter=True,
+                    meta={
+                        "depth": 1,
+                        "main_url": main_url,
+                        "handle_httpstatus_all": True,
+                        "dont_redirect": True,
+                    },
+                )
+            )
+    return requests
+
+
+def compact_requests(spider, pages):
+    requests = []
+    for main_url, urls in pages:
+        info = RequestInfo(1, main_url)
+        for url in urls:
+            requests.append(
+                CrauRequest(
+                    url,
+                    callback=spider.parse,
+                    errback=spider.parse_request_error,
+                    dont_filter=True,
+                    info=info,
+                )
+            )
+    return requests
+
+
+def create_queue(crawler):
+    """Create the scheduler's memory priority queue, like scrapy's `Scheduler`"""
+    settings = crawler.settings
+    return create_instance(
+        load_object(settings["SCHEDULER_PRIORITY_QUEUE"]),
+        settings=None,
+        crawler=crawler,
+        downstream_queue_cls=load_object(settings["SCHEDULER_MEMORY_QUEUE"]),
+        key="",
+    )
+
+
+def measure(function, crawler, pages):
+    """Return the number of bytes allocated (and kept) per queued request"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = create_queue(crawler)
+    requests = function(crawler.spider, pages)
+    for request in requests:
+        queue.push(request)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(queue)
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    link_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    crawler = get_crawler(CrauSpider)
+    crawler.spider = CrauSpider.from_crawler(crawler, warc_filename=None, urls=[])
+    crawler.engine = SimpleNamespace(downloader=Downloader(crawler))
+    pages = [
+        (
+            f"https://example.com/page/{page}",
+            [f"https://example.com/page/{page}/{link}" for link in range(link_count)],
+        )
+        for page in range(page_count)
+    ]
+
+    print(f"{page_count * link_count} requests ({link_count} per page)")
+    print(f"{'metadata':<10} {'bytes/request':>14}")
+    for name, function in (("legacy", legacy_requests), ("compact", compact_requests)):
+        print(f"{name:<10} {measure(function, crawler, pages):14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,15 @@
 from .cli import cli  # noqa
-from .spider import CrauSpider  # noqa
 from .version import __version__  # noqa
+
+
+def __getattr__(name):
+    # Imported only when needed, since they import scrapy (which is slow)
+    if name == "archive_async":
+        from .api import archive_async
+
+        return archive_async
+    elif name == "CrauSpider":
+        from .spider import CrauSpider
+
+        return CrauSpider
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
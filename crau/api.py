@@ -0,0 +1,123 @@
+import asyncio
+import sys
+from functools import partial
+from threading import Lock, Thread
+
+from scrapy.crawler import CrawlerRunner
+from scrapy.settings import Settings
+from scrapy.utils.misc import create_instance, load_object
+
+from .spider import CrauSpider
+from .version import __version__
+
+ASYNCIO_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
+DEFAULT_SETTINGS = {
+    "USER_AGENT": f"crau {__version__}",
+}
+_reactor_lock = Lock()
+_reactor_thread = None
+
+
+def start_reactor_thread(runner):
+    """Return Twisted's reactor, running it in a dedicated thread if needed
+
+    If no reactor was installed, the asyncio reactor (with its own event loop)
+    is installed. The reactor, its thread pool and the DNS cache resolver
+    (configured using `runner`'s settings) are started only once per process
+    and shared by all jobs, from any asyncio event loop (so `asyncio.run` may
+    be called many times). A reactor already running (like in a Twisted
+    application) is used as is.
+    """
+    global _reactor_thread
+
+    with _reactor_lock:
+        if "twisted.internet.reactor" not in sys.modules:
+            from twisted.internet import asyncioreactor
+
+            asyncioreactor.install(eventloop=asyncio.new_event_loop())
+        from twisted.internet import reactor
+
+        if _reactor_thread is not None or reactor.running:
+            return reactor
+
+        resolver_class = load_object(runner.settings["DNS_RESOLVER"])
+        resolver = create_instance(
+            resolver_class, runner.settings, runner, reactor=reactor
+        )
+        resolver.install_on_reactor()
+        thread_pool = reactor.getThreadPool()
+        thread_pool.adjustPoolsize(
+            maxthreads=runner.settings.getint("REACTOR_THREADPOOL_MAXSIZE")
+        )
+        # The reactor is never stopped, so its threads must not keep the
+        # process alive after the main thread finishes.
+        thread_pool.threadFactory = partial(Thread, daemon=True)
+        _reactor_thread = Thread(
+            target=_run_reactor, args=(reactor,), name="crau-reactor", daemon=True
+        )
+        _reactor_thread.start()
+        return reactor
+
+
+def _run_reactor(reactor):
+    loop = getattr(reactor, "_asyncioEventloop", None)
+    if loop is not None:
+        # scrapy gets the reactor's loop using `asyncio.get_event_loop()`
+        asyncio.set_event_loop(loop)
+    reactor.run(installSignalHandlers=False)
+
+
+def _resolve(future, result=None, exception=None):
+    if future.done():  # Cancelled by the caller
+        return
+    elif exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+async def archive_async(
+    warc_filename, urls, max_depth=1, allowed_uris=None, settings=None
+):
+    """Archive `urls` to `warc_filename` from inside a running asyncio loop
+
+    Many jobs can run concurrently (in the same or in different event loops),
+    each one with its own WARC file, settings and stats (which are returned
+    when it finishes). Crawls run in the reactor's thread.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    job_settings = Settings(DEFAULT_SETTINGS)
+    job_settings.update(settings or {})
+    reactor = start_reactor_thread(CrawlerRunner(job_settings))
+    if getattr(reactor, "_asyncioEventloop", None) is not None:
+        job_settings.set("TWISTED_REACTOR", ASYNCIO_REACTOR, priority="default")
+    else:  # Another reactor was installed before (scrapy must accept it)
+        job_settings.set("TWISTED_REACTOR", None, priority="default")
+    crawlers = []
+
+    def finished(result, crawler):
+        loop.call_soon_threadsafe(_resolve, future, crawler.stats.get_stats())
+
+    def failed(failure):
+        loop.call_soon_threadsafe(_resolve, future, None, failure.value)
+
+    def crawl():
+        runner = CrawlerRunner(job_settings)
+        crawler = runner.create_crawler(CrauSpider)
+        crawlers.append(crawler)
+        deferred = runner.crawl(
+            crawler,
+            warc_filename=warc_filename,
+            urls=urls,
+            max_depth=max_depth,
+            allowed_uris=allowed_uris,
+        )
+        deferred.addCallbacks(finished, failed, callbackArgs=(crawler,))
+
+    reactor.callFromThread(crawl)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        reactor.callFromThread(lambda: [crawler.stop() for crawler in crawlers])
+        raise
@@ -0,0 +1,228 @@
+import logging
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from .utils import canonicalize_url, url_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteCacheStorage:
+    """Scrapy HTTP cache storage keeping all responses in one SQLite file
+
+    Scrapy's default filesystem storage creates some files per response, which
+    is slow on big crawls. Besides `HTTPCACHE_DIR`, `HTTPCACHE_EXPIRATION_SECS`
+    (TTL) and `HTTPCACHE_GZIP`, the setting `CRAU_HTTPCACHE_MAX_SIZE` (in
+    bytes, 0 means unlimited) is used to evict the oldest responses. Requests
+    are identified the same way crau's dedup filter does (canonicalized URL).
+    """
+
+    # Responses are buffered in memory and written in one short transaction
+    # when any of these limits is reached, so the write lock isn't held
+    # between responses and many crawls can share the same file.
+    commit_every = 100
+    commit_max_bytes = 8 * 1024 * 1024
+    commit_interval = 5  # seconds
+    busy_timeout = 0.1  # seconds waiting for other writers (per attempt)
+    close_attempts = 100
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.max_size = settings.getint("CRAU_HTTPCACHE_MAX_SIZE")
+        self.use_gzip = settings.getbool("HTTPCACHE_GZIP")
+        self.connection = None
+
+    def open_spider(self, spider):
+        filename = Path(self.cachedir) / f"{spider.name}.sqlite3"
+        logger.debug(f"Using SQLite cache storage in {filename}")
+        # Autocommit mode: transactions are started explicitly (see `write`)
+        self.connection = sqlite3.connect(
+            str(filename), timeout=self.busy_timeout, isolation_level=None
+        )
+        self._pending = {}  # Fingerprint: row not written yet
+        self._pending_bytes = 0
+        self._last_commit = time.monotonic()
+
+        self.connection.execute("PRAGMA busy_timeout = 5000")  # Only for setup
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        busy_timeout_ms = int(self.busy_timeout * 1000)
+        self.connection.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+
+        def setup(connection):
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS response (
+                    fingerprint BLOB PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers BLOB NOT NULL,
+                    body BLOB NOT NULL,
+                    gzip INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS response_created_at "
+                "ON response (created_at)"
+            )
+            if self.expiration_secs > 0:
+                connection.execute(
+                    "DELETE FROM response WHERE created_at < ?",
+                    (time.time() - self.expiration_secs,),
+                )
+            self.read_size(connection)
+            self.evict()
+
+        if not self.write(setup, attempts=self.close_attempts):
+            raise sqlite3.OperationalError(f"Cache database is locked: {filename}")
+
+    def close_spider(self, spider):
+        if not self.flush(attempts=self.close_attempts):
+            logger.warning(
+                f"Could not write {len(self._pending)} responses to the cache "
+                "(database is locked)"
+            )
+        self.connection.close()
+        self.connection = None
+
+    def write(self, function, attempts=1):
+        """Run `function(connection)` in a write transaction
+
+        Return False if the database stays locked by other writers during all
+        `attempts` (each one waits `busy_timeout` seconds).
+        """
+        for attempt in range(attempts):
+            try:
+                self.connection.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as exception:
+                if "locked" not in str(exception) and "busy" not in str(exception):
+                    raise
+                continue
+            try:
+                function(self.connection)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return True
+        return False
+
+    def flush(self, attempts=1):
+        """Write buffered responses, returning False if database is locked"""
+        if not self._pending:
+            return True
+        rows = list(self._pending.values())
+
+        def insert(connection):
+            connection.executemany(
+                "INSERT OR REPLACE INTO response "
+                "(fingerprint, url, status, headers, body, gzip, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            # Other crawls may share the database, so the size is read again
+            # (inside the transaction) before evicting.
+            self.read_size(connection)
+            self.evict()
+
+        if not self.write(insert, attempts=attempts):
+            return False  # Kept in memory, retried on next store/close
+        self._pending.clear()
+        self._pending_bytes = 0
+        self._last_commit = time.monotonic()
+        return True
+
+    def read_size(self, connection):
+        self.size = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response"
+        ).fetchone()[0]
+
+    def fingerprint(self, request):
+        return url_fingerprint(
+            canonicalize_url(request.url), request.method, request.body
+        )
+
+    def retrieve_response(self, spider, request):
+        """Return response if present in cache, or None otherwise"""
+        fingerprint = self.fingerprint(request)
+        row = self._pending.get(fingerprint)
+        if row is not None:
+            row = row[1:6] + row[7:8]
+        else:
+            row = self.connection.execute(
+                "SELECT url, status, headers, body, gzip, created_at FROM response "
+                "WHERE fingerprint = ?",
+                (fingerprint,),
+            ).fetchone()
+        if row is None:
+            return None  # Not cached
+        url, status, raw_headers, body, gzip, created_at = row
+        if 0 < self.expiration_secs < time.time() - created_at:
+            return None  # Expired (will be replaced when stored again)
+
+        if gzip:
+            body = zlib.decompress(body)
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        response_class = responsetypes.from_args(headers=headers, url=url, body=body)
+        return response_class(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Store the given response in the cache, evicting old ones if needed"""
+        fingerprint = self.fingerprint(request)
+        body = response.body
+        if self.use_gzip:
+            body = zlib.compress(body)
+        headers = headers_dict_to_raw(response.headers)
+        size = len(body) + len(headers)
+        old = self._pending.get(fingerprint)
+        if old is not None:
+            self._pending_bytes -= old[6]
+        self._pending[fingerprint] = (
+            fingerprint,
+            response.url,
+            response.status,
+            headers,
+            body,
+            int(self.use_gzip),
+            size,
+            time.time(),
+        )
+        self._pending_bytes += size
+
+        # Writing in batches is much faster than one transaction per response
+        # (losing the last ones in a crash is OK for a cache).
+        if (
+            len(self._pending) >= self.commit_every
+            or self._pending_bytes >= self.commit_max_bytes
+            or time.monotonic() - self._last_commit >= self.commit_interval
+            or (self.max_size > 0 and self.size + self._pending_bytes > self.max_size)
+        ):
+            self.flush()
+
+    def evict(self):
+        """Delete oldest responses until cache size is below 90% of max size"""
+        if self.max_size <= 0 or self.size <= self.max_size:
+            return
+        target = self.max_size * 0.9
+        rows = self.connection.execute(
+            "SELECT fingerprint, size FROM response ORDER BY created_at"
+        )
+        to_delete = []
+        for fingerprint, size in rows:
+            if self.size <= target:
+                break
+            to_delete.append((fingerprint,))
+            self.size -= size
+        rows.close()
+        self.connection.executemany(
+            "DELETE FROM response WHERE fingerprint = ?", to_delete
+        )
@@ -11,17 +11,13 @@ from pathlib import Path
 from urllib.parse import quote, urljoin, urlparse
 
 import click
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.conf import arglist_to_dict
-from tqdm import tqdm
-from warcio.statusandheaders import StatusAndHeaders
-from warcio.warcwriter import WARCWriter
-
-from .io import archive_files
-from .spider import CrauSpider
-from .utils import HTTP_STATUS_CODES, WarcReader, get_urls_from_file
+
 from .version import __version__
 
+# Only lightweight modules are imported here: each command imports what it
+# needs, so read-only commands (like `list` and `extract`) start fast, without
+# importing scrapy/twisted.
+
 
 def run_command(command):
     print(f"*** Running command: {command}")
@@ -29,16 +25,82 @@ def run_command(command):
 
 
 def load_settings(ctx, param, value):
+    from scrapy.utils.conf import arglist_to_dict
+
     settings = {
         "HTTPCACHE_ENABLED": False,
+        "HTTPCACHE_STORAGE": "crau.cache.SqliteCacheStorage",
         "LOG_LEVEL": "CRITICAL",
-        "STATS_CLASS": "crau.utils.StdoutStatsCollector",
+        "STATS_CLASS": "crau.stats.StdoutStatsCollector",
         "USER_AGENT": f"crau {__version__}",
     }
     settings.update(arglist_to_dict(value))
     return settings
 
 
+def parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        shard, shard_count = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise click.BadParameter("must be in the format INDEX/COUNT (like 1/4)")
+    if not 1 <= shard <= shard_count:
+        raise click.BadParameter("INDEX must be between 1 and COUNT")
+    return shard, shard_count
+
+
+def parse_type_max_sizes(ctx, param, value):
+    max_sizes = {}
+    for item in value:
+        pattern, _, size = item.rpartition("=")
+        try:
+            max_sizes[pattern] = int(float(size) * 1024 * 1024)
+        except ValueError:
+            pattern = ""
+        if not pattern:
+            raise click.BadParameter(
+                "must be in the format MIME-TYPE=MiB (like image/*=20)"
+            )
+    return max_sizes
+
+
+def load_dictionary(ctx, param, value):
+    if value is None:
+        return None
+    return Path(value).read_bytes()
+
+
+def compression_options(function):
+    """Add WARC compression options (compression is chosen by file extension)"""
+    function = click.option(
+        "--compression-level",
+        type=int,
+        help="gzip (1-9, default: 9) or zstd (1-22, default: 3) level",
+    )(function)
+    function = click.option(
+        "--zstd-dictionary",
+        type=click.Path(exists=True, dir_okay=False),
+        callback=load_dictionary,
+        help="Pre-trained Zstandard dictionary (for .warc.zst files)",
+    )(function)
+    return function
+
+
+def check_compression(warc_filename, level, dictionary, default="none"):
+    """Check compression options for `warc_filename` before it's created"""
+    from .warc import check_compression_options, guess_compression
+
+    compression = guess_compression(warc_filename, default=default)
+    try:
+        check_compression_options(compression, level, dictionary)
+    except ValueError as exception:
+        param_hint = "--compression-level" if level is not None else None
+        if dictionary and compression != "zstd":
+            param_hint = "--zstd-dictionary"
+        raise click.BadParameter(str(exception), param_hint=param_hint)
+
+
 @click.group()
 @click.version_option(version=__version__, prog_name="crau")
 def cli():
@@ -48,6 +110,8 @@ def cli():
 @cli.command("list", help="List URIs of response records stored in a WARC file")
 @click.argument("warc_filename")
 def list_uris(warc_filename):
+    from .utils import WarcReader
+
     warc = WarcReader(warc_filename)
     for record in warc:
         if record.rec_type == "response":
@@ -60,6 +124,8 @@ def list_uris(warc_filename):
 @click.argument("uri")
 @click.argument("output")
 def extract_uri(chunk_size, warc_filename, uri, output):
+    from .utils import WarcReader
+
     warc = WarcReader(warc_filename)
     stream = warc.get_response(uri).content_stream()
 
@@ -76,16 +142,153 @@ def extract_uri(chunk_size, warc_filename, uri, output):
                 data = stream.read(chunk_size)
 
 
+@cli.command("merge", help="Merge WARC files, optionally splitting and compacting")
+@click.option(
+    "--max-size",
+    type=int,
+    help="Maximum size of each output file in MiB (output files are numbered)",
+)
+@click.option(
+    "--dedup", is_flag=True, help="Write duplicated payloads as revisit records"
+)
+@click.option(
+    "--drop-failed",
+    is_flag=True,
+    help="Drop responses with 5xx status codes (and their requests)",
+)
+@click.option("--index", is_flag=True, help="Write an index for each output file")
+@compression_options
+@click.argument("output_filename")
+@click.argument("input_filenames", nargs=-1, required=True)
+def merge(
+    output_filename,
+    input_filenames,
+    max_size,
+    dedup,
+    drop_failed,
+    index,
+    compression_level,
+    zstd_dictionary,
+):
+    from tqdm import tqdm
+
+    from .warc import WarcMerger, guess_compression, iter_records
+
+    check_compression(output_filename, compression_level, zstd_dictionary)
+    for filename in input_filenames:
+        if not Path(filename).exists():
+            click.echo(f"ERROR: filename {filename} does not exist.", err=True)
+            exit(2)
+
+    with WarcMerger(
+        output_filename,
+        max_size=max_size * 1024 * 1024 if max_size else None,
+        dedup=dedup,
+        drop_failed=drop_failed,
+        index=index,
+        compression=guess_compression(output_filename),
+        level=compression_level,
+        dictionary=zstd_dictionary,
+    ) as merger:
+        for record in tqdm(iter_records(input_filenames), "Merging records"):
+            merger.write(record)
+    stats = merger.stats
+    click.echo(
+        f"{stats['records']} records written to {len(merger.filenames)} file(s) "
+        f"({stats['revisits']} revisits, {stats['dropped']} dropped)",
+        err=True,
+    )
+
+
+@cli.command("verify", help="Check digests of all records in WARC files")
+@click.option(
+    "--jobs", "-j", type=int, help="Number of hashing threads (default: CPU count)"
+)
+@click.argument("warc_filenames", nargs=-1, required=True)
+def verify(jobs, warc_filenames):
+    from tqdm import tqdm
+
+    from .warc import verify_warcs
+
+    for filename in warc_filenames:
+        if not Path(filename).exists():
+            click.echo(f"ERROR: filename {filename} does not exist.", err=True)
+            exit(2)
+
+    total, invalid = 0, 0
+    results = verify_warcs(warc_filenames, jobs=jobs)
+    for filename, offset, rec_type, uri, errors in tqdm(results, "Verifying records"):
+        total += 1
+        if errors:
+            invalid += 1
+            tqdm.write(
+                f"{filename}:{offset} {rec_type} {uri or '-'}: "
+                f"invalid {', '.join(errors)}"
+            )
+    click.echo(f"{total} records verified, {invalid} invalid", err=True)
+    if invalid:
+        exit(1)
+
+
 @cli.command("archive", help="Archive a list of URLs to a WARC file")
 @click.argument("warc_filename")
-@click.option("--input-filename", "-i")
+@click.option(
+    "--input-filename",
+    "-i",
+    help="File with one URL per line (use `-` for stdin, can be gzipped)",
+)
 @click.option("--input-encoding", default="utf-8")
 @click.option("--cache", is_flag=True)
+@click.option("--cache-ttl", default=0, help="Cache expiration in seconds (0 = never)")
+@click.option(
+    "--cache-max-size", default=0, help="Maximum cache size in MiB (0 = unlimited)"
+)
+@click.option(
+    "--cache-policy",
+    type=click.Choice(["all", "headers"]),
+    default="all",
+    help="Cache all responses or honor HTTP cache headers (RFC 2616)",
+)
+@click.option(
+    "--shard",
+    callback=parse_shard,
+    help="Archive only a slice of the URLs (INDEX/COUNT, like 1/4)",
+)
+@click.option(
+    "--allow-type",
+    multiple=True,
+    help="Download only responses with these MIME types (like text/html, image/*)",
+)
+@click.option(
+    "--deny-type",
+    multiple=True,
+    help="Abort download of responses with these MIME types (like video/*)",
+)
+@click.option(
+    "--type-max-size",
+    multiple=True,
+    callback=parse_type_max_sizes,
+    help="Maximum size in MiB for a MIME type (like image/*=20, 0 = unlimited)",
+)
+@click.option(
+    "--robots", is_flag=True, help="Obey robots.txt rules (including Crawl-delay)"
+)
+@click.option(
+    "--sitemaps",
+    is_flag=True,
+    help="Archive pages listed in the sitemaps of the seeds' (and allowed) hosts",
+)
+@click.option(
+    "--upgrade-https",
+    is_flag=True,
+    help="Request links as https:// for hosts redirecting http:// to https://",
+)
 @click.option("--max-depth", default=1)
 @click.option("--allowed-uris", multiple=True, default=[])
 @click.option("--autothrottle", is_flag=True)
 @click.option("--log-level", required=False)
 @click.option("--user-agent", required=False)
+@compression_options
 @click.option("--settings", "-s", multiple=True, default=[], callback=load_settings)
 @click.argument("URLs", nargs=-1, required=False)
 def archive(
@@ -93,14 +296,30 @@ def archive(
     input_filename,
     input_encoding,
     cache,
+    cache_ttl,
+    cache_max_size,
+    cache_policy,
+    shard,
+    allow_type,
+    deny_type,
+    type_max_size,
+    robots,
+    sitemaps,
+    upgrade_https,
     max_depth,
     allowed_uris,
     autothrottle,
     log_level,
     settings,
     user_agent,
+    compression_level,
+    zstd_dictionary,
     urls,
 ):
+    from scrapy.crawler import CrawlerProcess
+
+    from .spider import CrauSpider
+    from .utils import get_urls_from_file, normalize_seed_url, shard_urls
 
     if not input_filename and not urls:
         click.echo(
@@ -108,19 +327,48 @@ def archive(
             err=True,
         )
         exit(1)
+    check_compression(warc_filename, compression_level, zstd_dictionary, default="gzip")
 
     if input_filename:
-        if not Path(input_filename).exists():
+        if input_filename != "-" and not Path(input_filename).exists():
             click.echo(f"ERROR: filename {input_filename} does not exist.", err=True)
             exit(2)
         urls = get_urls_from_file(input_filename, encoding=input_encoding)
+    else:
+        urls = [url for url in map(normalize_seed_url, urls) if url is not None]
+
+    if shard is not None:
+        urls = shard_urls(urls, *shard)
 
     if cache:
         settings["HTTPCACHE_ENABLED"] = True
+        settings["HTTPCACHE_EXPIRATION_SECS"] = cache_ttl
+        settings["CRAU_HTTPCACHE_MAX_SIZE"] = cache_max_size * 1024 * 1024
+        if cache_policy == "headers":
+            settings["HTTPCACHE_POLICY"] = "scrapy.extensions.httpcache.RFC2616Policy"
+
+    if allow_type:
+        settings["CRAU_CONTENT_TYPE_ALLOW"] = list(allow_type)
+    if deny_type:
+        settings["CRAU_CONTENT_TYPE_DENY"] = list(deny_type)
+    if type_max_size:
+        settings["CRAU_CONTENT_TYPE_MAXSIZE"] = type_max_size
+
+    if robots:
+        settings["CRAU_ROBOTSTXT_OBEY"] = True
+    if sitemaps:
+        settings["CRAU_SITEMAPS"] = True
+    if upgrade_https:
+        settings["CRAU_HTTPS_UPGRADE"] = True
 
     if log_level:
         settings["LOG_LEVEL"] = log_level
 
+    if compression_level is not None:
+        settings["CRAU_WARC_COMPRESSION_LEVEL"] = compression_level
+    if zstd_dictionary is not None:
+        settings["CRAU_WARC_ZSTD_DICTIONARY"] = zstd_dictionary
+
     if user_agent:
         settings["USER_AGENT"] = user_agent
 
@@ -172,7 +420,23 @@ def play(warc_filename, port, bind):
 @click.argument("path_or_archive")
 @click.argument("warc_filename")
 @click.option("--inner-directory")
-def pack(start_url, path_or_archive, warc_filename, inner_directory=None):
+@compression_options
+def pack(
+    start_url,
+    path_or_archive,
+    warc_filename,
+    compression_level,
+    zstd_dictionary,
+    inner_directory=None,
+):
+    from tqdm import tqdm
+    from warcio.statusandheaders import StatusAndHeaders
+
+    from .io import archive_files
+    from .utils import HTTP_STATUS_CODES
+    from .warc import WarcWriter, guess_compression
+
+    check_compression(warc_filename, compression_level, zstd_dictionary)
     # TODO: move the packing code to another module
     if not start_url.endswith("/"):
         start_url = start_url + "/"
@@ -185,7 +449,12 @@ def pack(start_url, path_or_archive, warc_filename, inner_directory=None):
     offset = time.timezone if (time.localtime().tm_isdst == 0) else time.altzone
     tz = datetime.timezone(offset=-datetime.timedelta(seconds=offset))
     with warc_filename.open(mode="wb") as warc_fobj:
-        writer = WARCWriter(warc_fobj, gzip=warc_filename.suffixes[-1].lower() == ".gz")
+        writer = WarcWriter(
+            warc_fobj,
+            compression=guess_compression(warc_filename),
+            level=compression_level,
+            dictionary=zstd_dictionary,
+        )
         for file_info in tqdm(
             archive_files(path_or_archive, inner_directory), "Packing files"
         ):
@@ -203,7 +472,7 @@ def pack(start_url, path_or_archive, warc_filename, inner_directory=None):
                 f"GET {quote(path)} HTTP/1.1", [], is_http_request=True
             )
             writer.write_record(
-                writer.create_warc_record(
+                writer.create_digested_record(
                     url,
                     "request",
                     http_headers=http_headers,
@@ -224,7 +493,7 @@ def pack(start_url, path_or_archive, warc_filename, inner_directory=None):
                 is_http_request=False,
             )
             writer.write_record(
-                writer.create_warc_record(
+                writer.create_digested_record(
                     url,
                     "response",
                     payload=file_info.fobj,
@@ -0,0 +1,135 @@
+import logging
+from urllib.parse import urljoin, urlsplit
+
+from protego import Protego
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from twisted.internet.defer import Deferred
+
+from .utils import url_origin
+
+MAX_CRAWL_DELAY = 60  # Maximum robots.txt `Crawl-delay` honored (seconds)
+MAX_ROBOTS_REDIRECTS = 5
+
+
+class RobotsMiddleware:
+    """Downloader middleware fetching robots.txt once per origin
+
+    robots.txt is used to obey its rules (`CRAU_ROBOTSTXT_OBEY`, including
+    `Crawl-delay`) and to discover sitemaps (`CRAU_SITEMAPS`). Like in scrapy's
+    `RobotsTxtMiddleware`, requests wait for their origin's robots.txt in the
+    downloader (a `Deferred` is returned), so the scheduler and the start
+    requests are only consumed when the downloader has capacity. If rules are
+    not obeyed, requests don't wait and robots.txt is fetched only for the
+    origins whose sitemaps are discovered (see `CrauSpider.sitemaps_allowed`).
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.obey = crawler.settings.getbool("CRAU_ROBOTSTXT_OBEY")
+        self.sitemaps = crawler.settings.getbool("CRAU_SITEMAPS")
+        self.user_agent = crawler.settings.get("USER_AGENT", "crau")
+        # robots.txt state per origin (like `https://example.com`): a list of
+        # `Deferred`s waiting for it to be fetched or the parser (`None` if
+        # there are no rules).
+        self._parsers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not (
+            settings.getbool("CRAU_ROBOTSTXT_OBEY") or settings.getbool("CRAU_SITEMAPS")
+        ):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        if "robots_origin" in request.meta:  # robots.txt itself
+            return None
+        origin = url_origin(request.url)
+        if origin not in self._parsers:
+            sitemaps = self.sitemaps and spider.sitemaps_allowed(request.url)
+            if not self.obey and not sitemaps:
+                return None
+            self._parsers[origin] = []
+            self.fetch_robots(spider, origin, f"{origin}/robots.txt", sitemaps)
+        if not self.obey:
+            return None
+
+        state = self._parsers[origin]
+        if isinstance(state, list):
+            deferred = Deferred()
+            deferred.addCallback(self.check_request, request)
+            state.append(deferred)
+            return deferred
+        return self.check_request(state, request)
+
+    def check_request(self, parser, request):
+        """Raise `IgnoreRequest` if `parser`'s rules don't allow `request`"""
+        if parser is not None and not parser.can_fetch(request.url, self.user_agent):
+            logging.debug(f"IGNORING (disallowed by robots.txt) {request.url}")
+            self.crawler.stats.inc_value("crau/robots_denied")
+            raise IgnoreRequest("Forbidden by robots.txt")
+        return None
+
+    def fetch_robots(self, spider, origin, url, sitemaps, redirects=0):
+        request = spider.robots_request(url, origin)
+        deferred = self.crawler.engine.download(request)
+        deferred.addCallbacks(
+            self.parse_robots,
+            self.robots_error,
+            callbackArgs=(spider, origin, sitemaps, redirects),
+            errbackArgs=(spider, origin, sitemaps),
+        )
+
+    def parse_robots(self, response, spider, origin, sitemaps, redirects):
+        spider.write_warc(response)
+        location = response.headers.get("Location")
+        if (
+            300 <= response.status <= 399
+            and location
+            and redirects < MAX_ROBOTS_REDIRECTS
+        ):
+            redirect_url = urljoin(response.url, location.decode("latin-1"))
+            self.fetch_robots(spider, origin, redirect_url, sitemaps, redirects + 1)
+            return
+
+        parser = None
+        if response.status == 200:
+            parser = Protego.parse(response.body.decode("utf-8", errors="replace"))
+        self.release(spider, origin, parser, sitemaps)
+
+    def robots_error(self, failure, spider, origin, sitemaps):
+        # Unavailable robots.txt means everything is allowed
+        logging.debug(f"robots.txt unavailable for {origin}: {failure.value}")
+        self.release(spider, origin, None, sitemaps)
+
+    def release(self, spider, origin, parser, sitemaps):
+        """Store `origin`'s parser, request its sitemaps and resume requests"""
+        waiting = self._parsers[origin]
+        self._parsers[origin] = parser
+        if parser is not None and self.obey:
+            delay = parser.crawl_delay(self.user_agent)
+            if delay:
+                self.set_crawl_delay(
+                    urlsplit(origin).hostname, min(float(delay), MAX_CRAWL_DELAY)
+                )
+
+        if sitemaps:
+            urls = list(parser.sitemaps) if parser is not None else []
+            for url in urls or [f"{origin}/sitemap.xml"]:
+                request = spider.sitemap_request(url)
+                if request is not None:
+                    self.crawler.engine.crawl(request)
+
+        for deferred in waiting:
+            deferred.callback(parser)
+
+    def set_crawl_delay(self, hostname, delay):
+        """Set the download delay of `hostname`'s downloader slot"""
+        downloader = self.crawler.engine.downloader
+        # Slots are created (and garbage-collected) on demand, using these
+        # settings; the slot key is the hostname by default
+        downloader.per_slot_settings.setdefault(hostname, {})["delay"] = delay
+        slot = downloader.slots.get(hostname)
+        if slot is not None:
+            slot.delay = max(slot.delay, delay)
@@ -1,16 +1,49 @@
+import io
 import logging
-import re
 from collections import namedtuple
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 
 from scrapy import Request, Spider, signals
-from scrapy.utils.request import request_fingerprint
-from warcio.warcwriter import WARCWriter
-
-from .utils import resource_matches_base_url, write_warc_request_response
-
-Resource = namedtuple("Resource", ["name", "type", "link_type", "content"])
-REGEXP_CSS_URL = re.compile(r"""url\(['"]?(.*?)['"]?\)""")
+from scrapy.exceptions import StopDownload
+from scrapy.http.request import NO_CALLBACK
+
+from .utils import (
+    ContentTypePolicy,
+    canonicalize_url,
+    extract_css_urls,
+    extract_js_urls,
+    iter_chunks,
+    iter_sitemap_urls,
+    looks_binary,
+    media_type,
+    parse_srcset,
+    resource_matches_base_url,
+    url_fingerprint,
+    url_origin,
+    write_warc_request_response,
+)
+from .warc import WarcWriter, guess_compression
+
+# Maximum number of bytes of code (inline or not) scanned for dependencies in
+# each document, so huge JS bundles or stylesheets can't stall the crawler.
+CODE_SCAN_BUDGET = 2 * 1024 * 1024
+MAX_REDIRECTS = 20  # Same as scrapy's `REDIRECT_MAX_TIMES`
+ROBOTS_PRIORITY = 1000  # Same as scrapy's `RobotsTxtMiddleware`
+SITEMAP_MAXSIZE = 50 * 1024 * 1024  # Sitemaps protocol limit (uncompressed)
+
+
+def link_rel_xpath(*rels):
+    """XPath condition matching `<link>` elements having any of `rels`"""
+    return " or ".join(
+        f"contains(concat(' ', normalize-space(@rel), ' '), ' {rel} ')" for rel in rels
+    )
+
+
+LINK_REL_ICON = link_rel_xpath(
+    "icon", "apple-touch-icon", "apple-touch-icon-precomposed", "mask-icon"
+)
+LINK_REL_PRELOAD = link_rel_xpath("preload")
+LINK_REL_MODULEPRELOAD = link_rel_xpath("modulepreload")
 
 Extractor = namedtuple("Extractor", ["name", "type", "link_type", "xpath"])
 EXTRACTORS = [
@@ -23,6 +56,28 @@ EXTRACTORS = [
     Extractor(
         name="media", type="link", link_type="dependency", xpath="//object/@data"
     ),
+    Extractor(name="media", type="link", link_type="dependency", xpath="//*/@data-src"),
+    Extractor(
+        name="srcset", type="code", link_type="dependency", xpath="//img/@srcset"
+    ),
+    Extractor(
+        name="srcset", type="code", link_type="dependency", xpath="//source/@srcset"
+    ),
+    Extractor(
+        name="srcset", type="code", link_type="dependency", xpath="//*/@data-srcset"
+    ),
+    Extractor(
+        name="media",
+        type="link",
+        link_type="dependency",
+        xpath=f"//link[{LINK_REL_ICON}]/@href",
+    ),
+    Extractor(
+        name="media",
+        type="link",
+        link_type="dependency",
+        xpath=f"//link[({LINK_REL_PRELOAD}) and not(@as = 'style' or @as = 'script')]/@href",
+    ),
     # CSS
     Extractor(
         name="css",
@@ -30,10 +85,22 @@ EXTRACTORS = [
         link_type="dependency",
         xpath="//link[@rel = 'stylesheet']/@href",
     ),
+    Extractor(
+        name="css",
+        type="link",
+        link_type="dependency",
+        xpath=f"//link[({LINK_REL_PRELOAD}) and @as = 'style']/@href",
+    ),
     Extractor(name="css", type="code", link_type="dependency", xpath="//style/text()"),
     Extractor(name="css", type="code", link_type="dependency", xpath="//*/@style"),
     # JavaScript
     Extractor(name="js", type="link", link_type="dependency", xpath="//script/@src"),
+    Extractor(
+        name="js",
+        type="link",
+        link_type="dependency",
+        xpath=f"//link[{LINK_REL_MODULEPRELOAD} or (({LINK_REL_PRELOAD}) and @as = 'script')]/@href",
+    ),
     Extractor(name="js", type="code", link_type="dependency", xpath="//script/text()"),
     # TODO: add "javascript:XXX" on //a/@href etc.
     # TODO: add inline JS (onload, onchange, onclick etc.)
@@ -47,23 +114,54 @@ EXTRACTORS = [
         name="other",
         type="link",
         link_type="anchor",
-        xpath="//link[not(@rel = 'stylesheet')]/@href",
+        xpath=(
+            "//link[not(@rel = 'stylesheet' or "
+            f"{LINK_REL_ICON} or {LINK_REL_PRELOAD} or {LINK_REL_MODULEPRELOAD})]"
+            "/@href"
+        ),
     ),
-    # TODO: link rel=icon should be considered a dependency (what about other
-    # link rel=xxx?)
-    # TODO: add all other "//link/@href"
 ]
 
 
 def extract_resources(response):
+    """Yield `(extractor, content)` for each resource found in `response`"""
     for extractor in EXTRACTORS:
         for content in response.xpath(extractor.xpath).extract():
-            yield Resource(
-                name=extractor.name,
-                type=extractor.type,
-                link_type=extractor.link_type,
-                content=content,
-            )
+            yield extractor, content
+
+
+class RequestInfo:
+    """Crawl metadata of a request (see `CrauRequest`)
+
+    It's immutable, so all requests found in the same document (with the same
+    depth) share one instance.
+    """
+
+    __slots__ = ("depth", "main_url", "redirect_chain")
+
+    def __init__(self, depth, main_url, redirect_chain=()):
+        self.depth = depth
+        self.main_url = main_url
+        self.redirect_chain = redirect_chain
+
+    def __repr__(self):
+        return f"RequestInfo(depth={self.depth!r}, main_url={self.main_url!r})"
+
+
+class CrauRequest(Request):
+    """`Request` with crawl metadata in `info` (a `RequestInfo`)
+
+    With a lot of queued requests, a slot pointing to a shared `RequestInfo`
+    is smaller than a `meta` dict with these keys per request (scrapy's
+    priority queue still creates an empty `meta` for each queued request).
+    """
+
+    __slots__ = ("info",)
+    attributes = Request.attributes + ("info",)
+
+    def __init__(self, *args, info=None, **kwargs):
+        self.info = info
+        super().__init__(*args, **kwargs)
 
 
 class CrauSpider(Spider):
@@ -75,8 +173,13 @@ class CrauSpider(Spider):
         "DNSCACHE_ENABLED": True,
         "DNSCACHE_SIZE": 500000,
         "DNS_TIMEOUT": 5,
+        "DOWNLOADER_MIDDLEWARES": {"crau.robots.RobotsMiddleware": 100},
         "DOWNLOAD_MAXSIZE": 5 * 1024 * 1024,
         "DOWNLOAD_TIMEOUT": 15,
+        # All responses (including errors and redirects) are archived, without
+        # per-request `meta` keys
+        "HTTPERROR_ALLOW_ALL": True,
+        "METAREFRESH_ENABLED": False,
         "REACTOR_THREADPOOL_MAXSIZE": 40,
         "REDIRECT_ENABLED": False,
         "SCHEDULER_PRIORITY_QUEUE": "scrapy.pqueues.DownloaderAwarePriorityQueue",
@@ -92,14 +195,43 @@ class CrauSpider(Spider):
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super().from_crawler(crawler, *args, **kwargs)
         crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
+        spider.content_type_policy = ContentTypePolicy(
+            allow=crawler.settings.getlist("CRAU_CONTENT_TYPE_ALLOW"),
+            deny=crawler.settings.getlist("CRAU_CONTENT_TYPE_DENY"),
+            max_sizes=crawler.settings.getdict("CRAU_CONTENT_TYPE_MAXSIZE"),
+        )
+        if spider.content_type_policy:
+            crawler.signals.connect(
+                spider.headers_received, signal=signals.headers_received
+            )
+        spider.upgrade_https = crawler.settings.getbool("CRAU_HTTPS_UPGRADE")
         return spider
 
-    def __init__(self, warc_filename, urls, max_depth=1, allowed_uris=None):
+    def __init__(
+        self,
+        warc_filename,
+        urls,
+        max_depth=1,
+        allowed_uris=None,
+        code_scan_budget=CODE_SCAN_BUDGET,
+        max_redirects=MAX_REDIRECTS,
+    ):
         super().__init__()
         self.max_depth = int(max_depth)
+        self.code_scan_budget = int(code_scan_budget)
+        self.max_redirects = int(max_redirects)
         self.warc_filename = warc_filename
         self.urls = urls
         self._request_history = set()
+        # Payload digests of the archived responses (to find duplicated ones)
+        self._payload_digests = set()
+        # Hosts known to redirect `http://` URLs to the same `https://` ones
+        # (used only if `upgrade_https` is set)
+        self._https_hosts = set()
+        self.upgrade_https = False
+        self.content_type_policy = ContentTypePolicy()
+        # Origins of the seeds (their sitemaps are discovered)
+        self._seed_origins = set()
         self.warc_fobj = None
         self.warc_writer = None
         self.allowed_uris = allowed_uris if allowed_uris else []
@@ -108,41 +240,134 @@ class CrauSpider(Spider):
         if self.warc_fobj is not None:
             self.warc_fobj.close()
 
-    def make_request(self, request_class=Request, *args, **kwargs):
+    def headers_received(self, headers, body_length, request, spider):
+        """Apply the content type policy before the body is downloaded
+
+        Denied responses are aborted (the request fails) and the maximum body
+        size for the response's MIME type overrides `DOWNLOAD_MAXSIZE` (so the
+        download is cancelled when `Content-Length` or the received body
+        exceeds it). robots.txt and sitemaps are not filtered.
+        """
+        if "robots_origin" in request.meta or request.callback == self.parse_sitemap:
+            return
+        mime_type = media_type(headers.get(b"Content-Type"))
+        allowed, max_size = self.content_type_policy.decide(mime_type)
+        if not allowed:
+            logging.info(f"IGNORING (denied Content-Type {mime_type}) {request.url}")
+            self.crawler.stats.inc_value("crau/content_type_denied")
+            raise StopDownload(fail=True)
+        elif max_size is not None:
+            request.meta["download_maxsize"] = max_size
+
+    def make_request(self, request_class=CrauRequest, *args, **kwargs):
         """Method to create requests and implements a custom dedup filter"""
 
+        # This check filters duplicated requests - we don't use scrapy's dedup
+        # filter because it has a bug, which filters out requests in undesired
+        # cases <https://github.com/scrapy/scrapy/issues/1225>. Since most of
+        # the discovered links are duplicates, the check is done on the
+        # canonicalized URL string, before any `Request` object is created.
+        url = kwargs.get("url", args[0] if args else None)
+        if url is not None:
+            request_hash = url_fingerprint(
+                canonicalize_url(url),
+                kwargs.get("method", "GET"),
+                kwargs.get("body", b""),
+            )
+            # TODO: may move this in-memory set to a temp file since the
+            # number of requests can be pretty large.
+            if request_hash in self._request_history:
+                return None
+            self._request_history.add(request_hash)
+            if "#" in url:
+                url = url[: url.find("#")]
+                if "url" in kwargs:
+                    kwargs["url"] = url
+                else:
+                    args = (url,) + args[1:]
+
         kwargs["dont_filter"] = kwargs.get("dont_filter", True)
         kwargs["errback"] = kwargs.get("errback", self.parse_request_error)
 
-        meta = kwargs.get("meta", {})
-        meta["handle_httpstatus_all"] = meta.get("handle_httpstatus_all", True)
-        meta["dont_redirect"] = meta.get("dont_redirect", True)
-        kwargs["meta"] = meta
-
-        request = request_class(*args, **kwargs)
-        if "#" in request.url:
-            request = request.replace(url=request.url[: request.url.find("#")])
+        return request_class(*args, **kwargs)
+
+    def robots_request(self, url, origin):
+        """Return the request for `origin`'s robots.txt (see `RobotsMiddleware`)"""
+        self._request_history.add(url_fingerprint(canonicalize_url(url)))
+        return Request(
+            url,
+            callback=NO_CALLBACK,
+            dont_filter=True,
+            meta={"robots_origin": origin},
+            priority=ROBOTS_PRIORITY,
+        )
+
+    def sitemaps_allowed(self, url):
+        """Return `True` if sitemaps of `url`'s origin must be discovered
+
+        Only seeds' origins and the ones matched by `allowed_uris` are
+        discovered, since sitemaps' pages are also seeds (other hosts, like
+        CDNs or external links, would make the crawl unbounded).
+        """
+        if url_origin(url) in self._seed_origins:
+            return True
+        return bool(self.allowed_uris) and resource_matches_base_url(
+            url, self.allowed_uris
+        )
+
+    def sitemap_request(self, url):
+        return self.make_request(
+            url=url,
+            callback=self.parse_sitemap,
+            info=RequestInfo(0, url),
+            meta={"download_maxsize": SITEMAP_MAXSIZE},
+        )
+
+    def parse_sitemap(self, response):
+        """Save a sitemap and request its pages (as seeds) and inner sitemaps"""
+        if 300 <= response.status <= 399:
+            yield from self.follow_redirect(response)
+            return
 
-        # This `if` filters duplicated requests - we don't use scrapy's dedup
-        # filter because it has a bug, which filters out requests in undesired
-        # cases <https://github.com/scrapy/scrapy/issues/1225>.
-        # TODO: check if this dedup filter does not have the same problem
-        # scrapy have (the problem is related to canonicalize request url).
-        request_hash = request_fingerprint(request)
-        # TODO: may move this in-memory set to a temp file since the number of
-        # requests can be pretty large.
-        if request_hash in self._request_history:
-            return None
-        else:
-            self._request_history.add(request_hash)
-            return request
+        logging.debug(f"Saving SITEMAP {response.request.url}")
+        self.write_warc(response)
+        if response.status != 200:
+            return
+        hostname = urlsplit(response.url).hostname
+        page_info = RequestInfo(0, response.url)  # Pages are seeds
+        for kind, url in iter_sitemap_urls(io.BytesIO(response.body)):
+            url = urljoin(response.url, url)
+            if not url.startswith("http") or urlsplit(url).hostname != hostname:
+                continue  # Sitemaps can only list URLs from their own host
+            elif kind == "sitemap":
+                request = self.sitemap_request(url)
+            elif self.allowed_uris and not resource_matches_base_url(
+                url, self.allowed_uris
+            ):
+                continue
+            else:
+                request = self.make_request(
+                    url=url, callback=self.parse, info=page_info
+                )
+            if request is not None:
+                yield request
 
     def write_warc(self, response):
         # TODO: transform this method into `write_response` so we can have
         # other response writers than WARC (CSV, for example - would be great
         # if we can add specific parsers to save HTML's title and text into
         # CSV, for example).
-        write_warc_request_response(self.warc_writer, response)
+        digest = write_warc_request_response(self.warc_writer, response)
+        if not response.body:
+            return
+        elif digest in self._payload_digests:
+            # Same content archived before from another URL (a candidate for
+            # a `revisit` record)
+            stats = self.crawler.stats
+            stats.inc_value("crau/duplicate_payload_count")
+            stats.inc_value("crau/duplicate_payload_bytes", len(response.body))
+        else:
+            self._payload_digests.add(digest)
 
     def start_requests(self):
         """Start requests with depth = 0
@@ -152,58 +377,117 @@ class CrauSpider(Spider):
         incremented, and so on.
         """
         self.warc_fobj = open(self.warc_filename, mode="wb")
-        self.warc_writer = WARCWriter(self.warc_fobj, gzip=True)
-
+        level = self.settings.get("CRAU_WARC_COMPRESSION_LEVEL")
+        self.warc_writer = WarcWriter(
+            self.warc_fobj,
+            compression=self.settings.get("CRAU_WARC_COMPRESSION")
+            or guess_compression(self.warc_filename, default="gzip"),
+            level=int(level) if level is not None else None,
+            dictionary=self.settings.get("CRAU_WARC_ZSTD_DICTIONARY"),
+        )
+
+        # `self.urls` may be a huge lazy iterable: scrapy consumes this
+        # generator only when there's capacity in the downloader, so seeds are
+        # not all loaded into the scheduler at once.
         for url in self.urls:
-            yield self.make_request(
-                url=url, meta={"depth": 0, "main_url": url}, callback=self.parse
+            try:
+                self._seed_origins.add(url_origin(url))
+                request = self.make_request(
+                    url=url, info=RequestInfo(0, url), callback=self.parse
+                )
+            except ValueError as exception:
+                logging.warning(f"IGNORING invalid start URL {url!r}: {exception}")
+                continue
+            if request is not None:  # `None` means it's a duplicate
+                yield request
+
+    def follow_redirect(self, response):
+        """Save a 3xx response and request its `Location` (body isn't parsed)
+
+        The redirect chain is kept in the request's meta so loops and chains
+        longer than `max_redirects` are not followed. The target is requested
+        with the same callback and depth as the redirecting request.
+        """
+        request = response.request
+        info = request.info
+        logging.debug(f"[{info.depth}] Saving REDIRECT {request.url}")
+        self.write_warc(response)
+        location = response.headers.get("Location")
+        if not location:
+            return
+
+        redirect_url = urljoin(request.url, location.decode("latin-1"))
+        chain = info.redirect_chain + (request.url,)
+        canonical_url = canonicalize_url(redirect_url)
+        if canonical_url in {canonicalize_url(url) for url in chain}:
+            logging.info(
+                f"IGNORING redirect loop {' -> '.join(chain)} -> {redirect_url}"
             )
+            return
+        elif len(chain) > self.max_redirects:
+            logging.info(f"IGNORING (too many redirects) {redirect_url}")
+            return
+        elif (
+            self.upgrade_https
+            and request.url.startswith("http://")
+            and canonical_url == canonicalize_url("https://" + request.url[7:])
+        ):
+            self._https_hosts.add(urlsplit(request.url).hostname)
+
+        logging.debug(f"[{info.depth}] Redirecting to {redirect_url}")
+        request = self.make_request(
+            url=redirect_url,
+            callback=request.callback,
+            info=RequestInfo(info.depth, info.main_url, chain),
+        )
+        if request is not None:
+            yield request
 
     def parse(self, response):
+        if 300 <= response.status <= 399:
+            yield from self.follow_redirect(response)
+            return
+
         main_url = response.request.url
         # TODO: what if response.request.url != response.url?
-        current_depth = response.request.meta["depth"]
-        next_depth = current_depth + 1
+        current_depth = response.request.info.depth
 
-        content_type = response.headers.get("Content-Type", b"").decode(
-            "ascii"
-        )  # TODO: decode properly
-        if content_type and content_type.split(";")[0].lower() != "text/html":
+        content_type = media_type(response.headers.get("Content-Type"))
+        if content_type and content_type != "text/html":
             logging.debug(
                 f"[{current_depth}] Content-Type not found for {main_url}, parsing as media"
             )
-            yield self.parse_media(response)
+            yield from self.parse_media(response)
+            return
+        elif not hasattr(response, "xpath") or looks_binary(response.body):
+            # Mislabeled (or unlabeled) binary files are not parsed
+            logging.debug(
+                f"[{current_depth}] Binary content, parsing as media {main_url}"
+            )
+            yield from self.parse_media(response)
             return
 
         logging.debug(f"[{current_depth}] Saving HTML {response.request.url}")
         self.write_warc(response)
 
-        redirect_url = None
-        if 300 <= response.status <= 399 and "Location" in response.headers:
-            redirect_url = urljoin(
-                response.request.url,
-                response.headers["Location"].decode("ascii"),  # TODO: decode properly
-            )
-
-        for resource in extract_resources(response):
-            if resource.type == "link":
+        # Shared by all requests found in this page
+        infos = {
+            "dependency": RequestInfo(current_depth, main_url),
+            "anchor": RequestInfo(current_depth + 1, main_url),
+        }
+        scan_budget = self.code_scan_budget
+        for extractor, content in extract_resources(response):
+            if extractor.type == "link":
                 # TODO: handle "//" URLs correctly
-                absolute_url = urljoin(main_url, resource.content)
-                depth = None
-                if resource.link_type == "dependency":
-                    depth = current_depth
-                elif resource.link_type == "anchor":
-                    depth = next_depth
+                absolute_url = urljoin(main_url, content)
                 for request in self.collect_link(
-                    main_url, resource.name, absolute_url, depth
+                    infos[extractor.link_type], extractor.name, absolute_url
                 ):
-                    if request is None or (
-                        redirect_url is not None and redirect_url == request.url
-                    ):
+                    if request is None:
                         continue
                     elif (
                         self.allowed_uris
-                        and resource.link_type == "anchor"
+                        and extractor.link_type == "anchor"
                         and not resource_matches_base_url(
                             absolute_url, self.allowed_uris
                         )
@@ -212,32 +496,33 @@ class CrauSpider(Spider):
                         continue
                     yield request
 
-            elif resource.type == "code":
+            elif extractor.type == "code":
+                if scan_budget <= 0:
+                    logging.debug(
+                        f"[{current_depth}] IGNORING (scan budget exceeded) {extractor.name} code on {main_url}"
+                    )
+                    continue
+                code = content[:scan_budget]
+                scan_budget -= len(code)
                 for request in self.collect_code(
-                    main_url, resource.name, resource.content, current_depth
+                    infos["dependency"], extractor.name, code
                 ):
                     if request is None:
                         continue
                     yield request
 
-        if redirect_url is not None:
-            # TODO: how to deal with redirect loops?
-            logging.debug(f"[{current_depth}] Redirecting to {redirect_url}")
-            yield self.make_request(
-                url=redirect_url,
-                meta={"depth": current_depth, "main_url": main_url},
-                callback=self.parse,
-            )
-
     def parse_request_error(self, failure):
         pass
         # TODO: should we do something with this failure?
 
     def parse_css(self, response):
-        meta = response.request.meta
+        if 300 <= response.status <= 399:
+            yield from self.follow_redirect(response)
+            return
 
+        info = RequestInfo(response.request.info.depth, response.request.url)
         for request in self.collect_code(
-            response.request.url, "css", response.body, meta["depth"]
+            info, "css", memoryview(response.body)[: self.code_scan_budget]
         ):
             if request is None:
                 continue
@@ -247,10 +532,13 @@ class CrauSpider(Spider):
         self.write_warc(response)
 
     def parse_js(self, response):
-        meta = response.request.meta
+        if 300 <= response.status <= 399:
+            yield from self.follow_redirect(response)
+            return
 
+        info = RequestInfo(response.request.info.depth, response.request.url)
         for request in self.collect_code(
-            response.request.url, "js", response.body, meta["depth"]
+            info, "js", response.body[: self.code_scan_budget]
         ):
             if request is None:
                 continue
@@ -260,10 +548,16 @@ class CrauSpider(Spider):
         self.write_warc(response)
 
     def parse_media(self, response):
+        if 300 <= response.status <= 399:
+            yield from self.follow_redirect(response)
+            return
+
         logging.debug(f"Saving MEDIA {response.request.url}")
         self.write_warc(response)
 
-    def collect_link(self, main_url, link_type, url, depth):
+    def collect_link(self, info, link_type, url):
+        """Request `url` (found in `info.main_url`) with `info`'s depth"""
+        depth = info.depth
         if depth > self.max_depth:
             logging.debug(
                 f"[{depth}] IGNORING (depth exceeded) get link {link_type} {url}"
@@ -274,71 +568,53 @@ class CrauSpider(Spider):
             return []
 
         if link_type == "media":
-            return [
-                self.make_request(
-                    url=url,
-                    callback=self.parse_media,
-                    meta={"depth": depth, "main_url": main_url},
-                )
-            ]
+            callback = self.parse_media
         elif link_type == "css":
-            return [
-                self.make_request(
-                    url=url,
-                    callback=self.parse_css,
-                    meta={"depth": depth, "main_url": main_url},
-                )
-            ]
+            callback = self.parse_css
         elif link_type == "js":
-            return [
-                self.make_request(
-                    url=url,
-                    callback=self.parse_js,
-                    meta={"depth": depth, "main_url": main_url},
-                )
-            ]
-        elif link_type == "other":
-            return [
-                self.make_request(
-                    url=url,
-                    callback=self.parse,
-                    meta={"depth": depth, "main_url": main_url},
-                )
-            ]
+            callback = self.parse_js
         else:
-            return [
-                self.make_request(
-                    url=url,
-                    callback=self.parse,
-                    meta={"depth": depth, "main_url": main_url},
-                )
-            ]
-
-    def collect_code(self, main_url, code_type, code, depth):
+            callback = self.parse
+        if url.startswith("http://") and urlsplit(url).hostname in self._https_hosts:
+            # Skip the redirect (the `http://` capture won't be archived)
+            url = "https://" + url[7:]
+        return [self.make_request(url=url, callback=callback, info=info)]
+
+    def collect_code(self, info, code_type, code):
+        depth, main_url = info.depth, info.main_url
         if depth > self.max_depth:
             logging.debug(
                 f"[{depth}] IGNORING (depth exceeded) getting dependencies for {code_type}"
             )
             return []
         elif code_type == "css":
+            if isinstance(code, str):
+                code = code.encode("utf-8")
+            requests = []
+            for link_type, result in extract_css_urls(iter_chunks(code)):
+                url = urljoin(main_url, result)
+                requests.extend(self.collect_link(info, link_type, url))
+            return requests
+        elif code_type == "js":
             if isinstance(code, bytes):
-                code = code.decode("utf-8")  # TODO: decode properly
+                code = code.decode("utf-8", errors="replace")
             requests = []
-            for result in REGEXP_CSS_URL.findall(code):
+            for url in extract_js_urls(code, main_url):
+                path, link_type = urlsplit(url).path.lower(), "media"
+                if path.endswith(".css"):
+                    link_type = "css"
+                elif path.endswith(".js"):
+                    link_type = "js"
+                requests.extend(self.collect_link(info, link_type, url))
+            return requests
+        elif code_type == "srcset":
+            requests = []
+            for result in parse_srcset(code):
                 url = urljoin(main_url, result)
                 if url.startswith("data:"):
                     continue
-                requests.append(
-                    self.make_request(
-                        url=url,
-                        callback=self.parse_media,
-                        meta={"depth": depth, "main_url": main_url},
-                    )
-                )
+                requests.extend(self.collect_link(info, "media", url))
             return requests
-        elif code_type == "js":
-            # TODO: extract other references from JS code
-            return []
         else:
             logging.info(f"[{depth}] [TODO] PARSE CODE {code_type} {code}")
             return []
@@ -0,0 +1,16 @@
+from scrapy.statscollectors import MemoryStatsCollector
+from tqdm import tqdm
+
+
+class StdoutStatsCollector(MemoryStatsCollector):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.progress_bar = tqdm(
+            desc="Downloading", unit="req", unit_scale=True, dynamic_ncols=True
+        )
+
+    def inc_value(self, key, count=1, start=0, spider=None):
+        super().inc_value(key, count=count, start=start, spider=spider)
+        if key == "response_received_count":
+            self.progress_bar.n = self._stats["response_received_count"]
+            self.progress_bar.refresh()
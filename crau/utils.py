@@ -1,11 +1,18 @@
+import codecs
+import gzip
 import io
-from urllib.parse import urlparse
+import re
+import sys
+from fnmatch import fnmatchcase
+from hashlib import blake2b
+from itertools import chain
+from urllib.parse import urljoin, urlparse, urlsplit, urlunsplit
 
-from scrapy.statscollectors import MemoryStatsCollector
-from tqdm import tqdm
 from warcio.archiveiterator import ArchiveIterator
 from warcio.statusandheaders import StatusAndHeaders
 
+from .warc import open_warc
+
 # Status/messages taken from <https://en.wikipedia.org/wiki/List_of_HTTP_status_codes>
 HTTP_STATUS_CODES = {
     100: "Continue",
@@ -104,11 +111,370 @@ HTTP_STATUS_CODES = {
     598: "Network read timeout error",  # Unofficial/Informal convention
 }
 
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+# Any quoted string without spaces, quotes or backslashes: the length limit
+# keeps the scan linear even when a string literal is never closed.
+REGEXP_JS_STRING = re.compile(r"""(["'`])([^\s"'`<>\\]{1,2048})\1""")
+# CSS is scanned as bytes (in chunks), so big stylesheets are never decoded.
+# Only matched URLs are decoded, using the encoding declared in the file.
+REGEXP_CSS_DEPENDENCY = re.compile(
+    rb"""@import\s+(?:url\(\s*)?["']?(?P<import>[^"'\s);]{1,2048})"""
+    rb"""|url\(\s*(?:"(?P<double_quoted>[^"]{0,2048})"|'(?P<single_quoted>[^']{0,2048})'"""
+    rb"""|(?P<unquoted>[^"')\s]{0,2048}))"""
+    rb"""|(?P<image_set>image-set\()""",
+    re.IGNORECASE,
+)
+# Each item is an URL/string followed by optional descriptors (like `2x` or
+# `type("image/avif")`) and a comma.
+REGEXP_CSS_IMAGE_SET_ITEM = re.compile(
+    rb"""\s*(?:url\(\s*["']?(?P<url>[^"')\s]{1,2048})["']?\s*\)"""
+    rb"""|["'](?P<string>[^"']{1,2048})["'])"""
+    rb"""[^,()]{0,256}(?:\([^()]{0,256}\)[^,()]{0,256})?,?"""
+)
+REGEXP_CSS_CHARSET = re.compile(rb'^@charset "([^"]{1,64})";')
+CSS_CHUNK_SIZE = 64 * 1024
+# Must be greater than the longest match of the regular expressions above
+MAX_CSS_TOKEN_SIZE = 8 * 1024
+JS_DEPENDENCY_EXTENSIONS = (
+    ".css",
+    ".eot",
+    ".gif",
+    ".ico",
+    ".jpeg",
+    ".jpg",
+    ".js",
+    ".json",
+    ".mp3",
+    ".mp4",
+    ".otf",
+    ".png",
+    ".svg",
+    ".ttf",
+    ".webm",
+    ".webp",
+    ".woff",
+    ".woff2",
+)
+
+
+def canonicalize_url(url):
+    """Return the canonical form of `url`, used to find duplicated requests
+
+    Fragment is stripped, scheme and host are lowercased, default ports are
+    removed and query string parameters are sorted. The result must be used
+    only for comparing URLs, not for requesting them (servers may depend on
+    the original order of query string parameters).
+    """
+    url = url.split("#", 1)[0]
+    try:
+        scheme, netloc, path, query, _ = urlsplit(url)
+    except ValueError:  # Malformed URL (like an unclosed IPv6 address)
+        return url
+    scheme = scheme.lower()
+    userinfo, at, host = netloc.rpartition("@")
+    host = host.lower()
+    default_port = DEFAULT_PORTS.get(scheme)
+    if default_port is not None and host.endswith(f":{default_port}"):
+        host = host[: -len(default_port) - 1]
+    if query:
+        query = "&".join(sorted(query.split("&")))
+    return urlunsplit((scheme, userinfo + at + host, path or "/", query, ""))
+
+
+def url_origin(url):
+    """Return `url`'s origin (like `https://example.com`), in lowercase"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def url_fingerprint(canonical_url, method="GET", body=b""):
+    """128-bit digest identifying a request to an already canonicalized URL"""
+    # URL is length-prefixed and terminated, so it can't be confused with body
+    digest = blake2b(
+        f"{method.upper()} {len(canonical_url)} {canonical_url}\n".encode("utf-8"),
+        digest_size=16,
+    )
+    if body:
+        digest.update(body if isinstance(body, bytes) else body.encode("utf-8"))
+    return digest.digest()
+
+
+def iter_chunks(data, chunk_size=CSS_CHUNK_SIZE):
+    """Split a bytes-like object in chunks (without copying, if memoryview)"""
+    for start in range(0, len(data), chunk_size):
+        yield data[start : start + chunk_size]
+
+
+def detect_css_encoding(data):
+    """Detect CSS encoding from its BOM or `@charset` rule (default: UTF-8)"""
+    for bom, encoding in (
+        (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF32_LE, "utf-32"),
+        (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"),
+    ):
+        if data.startswith(bom):
+            return encoding
+    match = REGEXP_CSS_CHARSET.match(data)
+    if match is not None:
+        try:
+            encoding = codecs.lookup(match.group(1).decode("ascii")).name
+        except (LookupError, UnicodeDecodeError):
+            pass
+        else:
+            # If `@charset` could be read as ASCII, file is not in UTF-16/32
+            if not encoding.startswith(("utf-16", "utf-32")):
+                return encoding
+    return "utf-8"
+
+
+def extract_css_urls(chunks):
+    """Extract dependencies from CSS code, yielding `(link_type, url)` tuples
+
+    `chunks` is an iterable of bytes-like objects (see `iter_chunks`), so the
+    stylesheet doesn't need to be completely decoded (or even completely
+    loaded). `link_type` is "css" for `@import` rules and "media" for the
+    other URLs (`url()` and `image-set()`). `data:` URLs are ignored.
+    """
+    chunks, head = iter(chunks), b""
+    for chunk in chunks:  # Enough data to detect encoding
+        head += chunk
+        if len(head) >= 128:
+            break
+    chunks = chain([head], chunks)
+    encoding, decoder, buffer = detect_css_encoding(head), None, b""
+    if encoding.startswith(("utf-16", "utf-32")):
+        # Not ASCII-compatible, so chunks are transcoded to UTF-8
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        encoding = "utf-8"
+    while True:
+        chunk = next(chunks, None)
+        if chunk is not None:
+            if decoder is not None:
+                chunk = decoder.decode(bytes(chunk)).encode("utf-8")
+            buffer += chunk
+            # Matches starting after `limit` may be incomplete, so they're
+            # kept in the buffer to be scanned again with the next chunk.
+            limit = len(buffer) - MAX_CSS_TOKEN_SIZE
+            if limit <= 0:
+                continue
+        else:
+            limit = len(buffer)
+
+        position = 0
+        while True:
+            match = REGEXP_CSS_DEPENDENCY.search(buffer, position)
+            if match is None or match.start() >= limit:
+                break
+            position = match.end()
+            if match.lastgroup == "import":
+                values = [("css", match.group("import"))]
+            elif match.lastgroup != "image_set":
+                values = [("media", match.group(match.lastgroup))]
+            else:
+                values = []
+                item = REGEXP_CSS_IMAGE_SET_ITEM.match(buffer, position)
+                while item is not None and item.end() > position:
+                    values.append(("media", item.group("url") or item.group("string")))
+                    position = item.end()
+                    item = REGEXP_CSS_IMAGE_SET_ITEM.match(buffer, position)
+            for link_type, value in values:
+                value = value.strip()
+                if value and value[:5].lower() != b"data:":
+                    yield link_type, value.decode(encoding, errors="replace")
+
+        if chunk is None:
+            break
+        buffer = buffer[max(position, limit) :]
+
+
+def parse_srcset(value):
+    """Return the URLs inside a `srcset` attribute (descriptors are ignored)"""
+    urls = []
+    position, length = 0, len(value)
+    while position < length:
+        while position < length and (
+            value[position].isspace() or value[position] == ","
+        ):
+            position += 1
+        start = position
+        while position < length and not value[position].isspace():
+            position += 1
+        url = value[start:position]
+        if url.endswith(","):  # Candidate without descriptors
+            url = url.rstrip(",")
+        else:  # Skip descriptors (like "2x" or "100w") until next candidate
+            next_comma = value.find(",", position)
+            position = length if next_comma == -1 else next_comma + 1
+        if url:
+            urls.append(url)
+    return urls
+
+
+def extract_js_urls(code, base_url):
+    """Find same-site URLs to static files inside JavaScript string literals
+
+    Only strings which look like URLs/paths and point to a known static file
+    extension are considered, so common strings are not requested by mistake.
+    """
+    base_netloc = urlsplit(base_url).netloc.lower()
+    urls = []
+    for _, value in REGEXP_JS_STRING.findall(code):
+        if not value.startswith(("/", "./", "../", "http")):
+            continue
+        try:
+            url = urljoin(base_url, value)
+            parts = urlsplit(url)
+        except ValueError:  # Malformed URL (like an unclosed IPv6 address)
+            continue
+        if (
+            parts.scheme in ("http", "https")
+            and parts.netloc.lower() == base_netloc
+            and parts.path.lower().endswith(JS_DEPENDENCY_EXTENSIONS)
+        ):
+            urls.append(url)
+    return urls
+
+
+def open_text_file(filename, encoding="utf-8"):
+    """Open a text file for reading: `-` means stdin and `.gz` is decompressed"""
+    if filename == "-":
+        # Closing the returned file object won't close stdin
+        return open(sys.stdin.fileno(), encoding=encoding, closefd=False)
+    elif filename.lower().endswith(".gz"):
+        return gzip.open(filename, mode="rt", encoding=encoding)
+    return open(filename, encoding=encoding)
+
+
+def normalize_seed_url(value):
+    """Return a clean URL from a line of a seed list (None if there's no URL)"""
+    url = value.strip()
+    if not url or url.startswith("#"):
+        return None
+    elif "://" not in url:
+        url = f"http://{url}"
+    return url
+
 
 def get_urls_from_file(filename, encoding="utf-8"):
-    with open(filename, encoding=encoding) as fobj:
+    """Stream URLs from a seed list file, skipping blank and comment lines"""
+    with open_text_file(filename, encoding=encoding) as fobj:
         for line in fobj:
-            yield line.strip()
+            url = normalize_seed_url(line)
+            if url is not None:
+                yield url
+
+
+def url_shard(url, shard_count):
+    """Return the shard (starting at 1) of `url`, based on its canonical form
+
+    The same URL always belongs to the same shard, so seed lists can be split
+    across machines (even if the URL is on many lists) without coordination.
+    """
+    digest = url_fingerprint(canonicalize_url(url))
+    return int.from_bytes(digest[:8], "big") % shard_count + 1
+
+
+def shard_urls(urls, shard, shard_count):
+    """Filter `urls`, lazily, yielding only the ones which belong to `shard`"""
+    for url in urls:
+        if url_shard(url, shard_count) == shard:
+            yield url
+
+
+def media_type(content_type):
+    """Return the lowercase MIME type (without parameters) of a `Content-Type`"""
+    if isinstance(content_type, bytes):
+        content_type = content_type.decode("latin-1")
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def looks_binary(data):
+    """Sniff if `data` (the beginning of a body) is binary, not text"""
+    head = bytes(data[:1024])
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return False
+    return b"\x00" in head
+
+
+def iter_sitemap_urls(fobj):
+    """Stream `(kind, url)` from a sitemap (or sitemap index) XML file object
+
+    `kind` is "sitemap" for sitemap index entries and "url" for pages. gzipped
+    sitemaps are decompressed on the fly and elements are freed as they're
+    parsed, so huge sitemaps don't need to be loaded into memory.
+    """
+    from lxml import etree
+
+    head = fobj.read(2)
+    fobj.seek(-len(head), io.SEEK_CUR)
+    if head == b"\x1f\x8b":
+        fobj = gzip.GzipFile(fileobj=fobj)
+    elements = etree.iterparse(
+        fobj,
+        events=("end",),
+        tag=("{*}url", "{*}sitemap"),
+        recover=True,
+        resolve_entities=False,
+        no_network=True,
+        huge_tree=True,
+    )
+    try:
+        for _, element in elements:
+            kind = "sitemap" if etree.QName(element).localname == "sitemap" else "url"
+            for child in element:
+                if (
+                    isinstance(child.tag, str)
+                    and etree.QName(child).localname == "loc"
+                    and child.text
+                ):
+                    yield kind, child.text.strip()
+                    break
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    except (etree.XMLSyntaxError, OSError, EOFError):  # Not a sitemap/truncated
+        return
+
+
+class ContentTypePolicy:
+    """Decide by the `Content-Type` header if/how a response is downloaded
+
+    `allow` and `deny` are lists of MIME type patterns (like `image/*`) and
+    `max_sizes` maps patterns to the maximum body size in bytes (0 means
+    unlimited). The most specific (longest) matching pattern wins. Responses
+    without `Content-Type` are always allowed.
+    """
+
+    def __init__(self, allow=None, deny=None, max_sizes=None):
+        self.allow = [pattern.lower() for pattern in allow or []]
+        self.deny = [pattern.lower() for pattern in deny or []]
+        self.max_sizes = {
+            pattern.lower(): int(size) for pattern, size in (max_sizes or {}).items()
+        }
+        self._decisions = {}  # There are few distinct MIME types
+
+    def __bool__(self):
+        return bool(self.allow or self.deny or self.max_sizes)
+
+    @staticmethod
+    def _match(value, patterns):
+        matches = [pattern for pattern in patterns if fnmatchcase(value, pattern)]
+        return max(matches, key=len) if matches else None
+
+    def decide(self, mime_type):
+        """Return `(allowed, max_size)` for `mime_type` (`max_size` may be None)"""
+        decision = self._decisions.get(mime_type)
+        if decision is None:
+            allowed = not mime_type or (
+                (not self.allow or self._match(mime_type, self.allow) is not None)
+                and self._match(mime_type, self.deny) is None
+            )
+            pattern = self._match(mime_type, self.max_sizes)
+            max_size = self.max_sizes[pattern] if pattern is not None else None
+            decision = self._decisions[mime_type] = (allowed, max_size)
+        return decision
 
 
 class WarcReader:
@@ -117,7 +483,7 @@ class WarcReader:
         self.__fobj = None
 
     def __iter__(self):
-        self.__fobj = open(self.filename, mode="rb")
+        self.__fobj = open_warc(self.filename)
         self.__iterator = ArchiveIterator(self.__fobj)
         return self
 
@@ -144,20 +510,6 @@ class WarcReader:
             self.__fobj.close()
 
 
-class StdoutStatsCollector(MemoryStatsCollector):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.progress_bar = tqdm(
-            desc="Downloading", unit="req", unit_scale=True, dynamic_ncols=True
-        )
-
-    def inc_value(self, key, count=1, start=0, spider=None):
-        super().inc_value(key, count=count, start=start, spider=spider)
-        if key == "response_received_count":
-            self.progress_bar.n = self._stats["response_received_count"]
-            self.progress_bar.refresh()
-
-
 def get_headers_list(headers):
     # TODO: fix if list has more than one value
     # TODO: decode properly
@@ -168,6 +520,7 @@ def get_headers_list(headers):
 
 
 def write_warc_request_response(writer, response):
+    """Write request/response records, returning the response payload digest"""
     request = response.request
     path = request.url[request.url.find("/", len(urlparse(request.url).scheme) + 3) :]
 
@@ -178,7 +531,9 @@ def write_warc_request_response(writer, response):
         is_http_request=True,
     )
     writer.write_record(
-        writer.create_warc_record(request.url, "request", http_headers=http_headers)
+        writer.create_digested_record(
+            request.url, "request", request.body, http_headers=http_headers
+        )
     )
 
     # XXX: we're currently guessing the status "title" by its code, but this
@@ -191,14 +546,13 @@ def write_warc_request_response(writer, response):
         is_http_request=False,
     )
     # TODO: what about redirects?
-    writer.write_record(
-        writer.create_warc_record(
-            response.url,
-            "response",
-            payload=io.BytesIO(response.body),
-            http_headers=http_headers,
-        )
+    # Digests are computed once (while the body is in memory) and stored in
+    # the record, so the writer doesn't need to hash/buffer it again.
+    record = writer.create_digested_record(
+        response.url, "response", response.body, http_headers=http_headers
     )
+    writer.write_record(record)
+    return record.rec_headers.get_header("WARC-Payload-Digest")
 
 
 def resource_matches_base_url(absolute_url, allowed):
@@ -217,3 +571,13 @@ def resource_matches_base_url(absolute_url, allowed):
         )
         or not allowed
     )
+
+
+def __getattr__(name):
+    # `StdoutStatsCollector` was moved to `crau.stats`, so importing this
+    # module (used by read-only commands) doesn't import scrapy.
+    if name == "StdoutStatsCollector":
+        from .stats import StdoutStatsCollector
+
+        return StdoutStatsCollector
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
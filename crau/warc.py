@@ -0,0 +1,547 @@
+import base64
+import binascii
+import hashlib
+import io
+import json
+import os
+import stat
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.warcwriter import WARCWriter
+
+COMPRESSIONS = ("gzip", "zstd", "none")
+COMPRESSION_LEVELS = {"gzip": (1, 9), "zstd": (1, 22)}
+DIGEST_ALGORITHM = "sha1"  # Same as warcio's
+DIGEST_CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_SIZE = 512 * 1024
+VERIFY_MAX_BUFFER = 16 * 1024 * 1024  # Bigger records are hashed as streams
+# Zstandard magic numbers (the dictionary is stored in a skippable frame at
+# the beginning of the file, as in the WARC-zstd draft)
+ZSTD_FRAME_MAGIC = b"\x28\xb5\x2f\xfd"
+ZSTD_DICTIONARY_MAGIC = struct.pack("<I", 0x184D2A5D)
+
+
+def import_zstd():
+    """Return the Zstandard module from stdlib (Python 3.14+) or its backport"""
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            from backports import zstd
+        except ImportError:
+            raise RuntimeError(
+                "zstd compression needs Python 3.14+ or `pip install backports.zstd`"
+            )
+    return zstd
+
+
+def guess_compression(filename, default="none"):
+    """Guess WARC compression by `filename` extension"""
+    suffix = Path(filename).suffix.lower()
+    return {".gz": "gzip", ".zst": "zstd"}.get(suffix, default)
+
+
+def check_compression_options(compression, level=None, dictionary=None):
+    """Raise `ValueError` if `level`/`dictionary` can't be used by `compression`"""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression!r}")
+    elif level is not None:
+        if compression not in COMPRESSION_LEVELS:
+            raise ValueError("compression level needs gzip or zstd compression")
+        minimum, maximum = COMPRESSION_LEVELS[compression]
+        if not minimum <= level <= maximum:
+            raise ValueError(
+                f"{compression} compression level must be between {minimum} "
+                f"and {maximum}"
+            )
+    if dictionary and compression != "zstd":
+        raise ValueError("a dictionary can only be used with zstd compression")
+
+
+class GzipRecordWrapper:
+    """Compress what's written as a gzip member (one per record)"""
+
+    def __init__(self, out, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS + 16)
+        self.out = out
+
+    def write(self, data):
+        self.out.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.out.write(self.compressor.flush())
+        self.out.flush()
+
+
+class ZstdRecordWrapper:
+    """Compress what's written as a Zstandard frame (one per record)"""
+
+    def __init__(self, out, compressor):
+        self.compressor = compressor
+        self.out = out
+
+    def write(self, data):
+        self.out.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.out.write(self.compressor.flush(self.compressor.FLUSH_FRAME))
+        self.out.flush()
+
+
+def format_digest(digester):
+    """Format a hashlib object as a WARC digest (like `sha1:<base32>`)"""
+    return f"{digester.name}:{base64.b32encode(digester.digest()).decode('ascii')}"
+
+
+def parse_digest(value):
+    """Return `(algorithm, digest bytes)` from a WARC digest (base32 or hex)"""
+    algorithm, _, encoded = value.partition(":")
+    algorithm = algorithm.lower().replace("-", "")
+    try:
+        size = hashlib.new(algorithm).digest_size
+    except ValueError:
+        raise ValueError(f"Unknown digest algorithm: {algorithm!r}")
+    try:
+        if len(encoded) == size * 2:
+            digest = bytes.fromhex(encoded)
+        else:
+            digest = base64.b32decode(encoded.upper())
+    except (binascii.Error, ValueError):
+        raise ValueError(f"Invalid digest: {value!r}")
+    return algorithm, digest
+
+
+class RecordDigester:
+    """Compute the block and payload digests of a record in a single pass"""
+
+    def __init__(self, headers_buff=b"", algorithm=DIGEST_ALGORITHM):
+        self.block = hashlib.new(algorithm, headers_buff)
+        self.payload = hashlib.new(algorithm)
+        self.length = 0
+
+    def update(self, data):
+        self.block.update(data)
+        self.payload.update(data)
+        self.length += len(data)
+
+    @property
+    def headers(self):
+        return {
+            "WARC-Block-Digest": format_digest(self.block),
+            "WARC-Payload-Digest": format_digest(self.payload),
+        }
+
+
+def is_regular_file(fobj):
+    try:
+        return stat.S_ISREG(os.fstat(fobj.fileno()).st_mode)
+    except (AttributeError, OSError):
+        return False
+
+
+class WarcWriter(WARCWriter):
+    """warcio's `WARCWriter` with configurable compression (per record)
+
+    `compression` can be "gzip" (`level` from 1 to 9, default 9), "zstd"
+    (`level` from 1 to 22, default 3, optionally using a pre-trained
+    `dictionary`, which is stored in the file) or "none".
+    """
+
+    def __init__(
+        self, filebuf, compression="gzip", level=None, dictionary=None, **kwargs
+    ):
+        check_compression_options(compression, level, dictionary)
+        super().__init__(filebuf, gzip=False, **kwargs)
+        self.compression = compression
+        self.level = level
+        if compression == "gzip" and level is None:
+            self.level = 9  # Same as warcio's
+        elif compression == "zstd":
+            zstd = import_zstd()
+            zstd_dict = zstd.ZstdDict(dictionary) if dictionary else None
+            self.zstd_compressor = zstd.ZstdCompressor(level=level, zstd_dict=zstd_dict)
+            if dictionary:
+                filebuf.write(
+                    ZSTD_DICTIONARY_MAGIC + struct.pack("<I", len(dictionary))
+                )
+                filebuf.write(dictionary)
+
+    def _write_warc_record(self, out, record):
+        if self.compression == "gzip":
+            out = GzipRecordWrapper(out, self.level)
+        elif self.compression == "zstd":
+            out = ZstdRecordWrapper(out, self.zstd_compressor)
+        super()._write_warc_record(out, record)
+
+    def create_digested_record(
+        self, uri, record_type, payload=b"", http_headers=None, warc_headers_dict=None
+    ):
+        """Create a record computing its digests and length in a single pass
+
+        warcio hashes the payload when the record is created and again (with
+        the HTTP headers, copying the payload to a temporary file) when it's
+        written if the length is unknown. Here `payload` (bytes or a file
+        object) is read once and both digests are stored in the record, so
+        they're reused by the writer and by dedup/index. Regular files are
+        rewound; other file objects are spooled to a temporary file.
+        """
+        headers_buff = b""
+        if http_headers is not None:
+            http_headers.compute_headers_buffer(self.header_filter)
+            headers_buff = http_headers.headers_buff
+        digester = RecordDigester(headers_buff)
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            digester.update(payload)
+            stream = io.BytesIO(payload)
+        elif is_regular_file(payload):
+            position = payload.tell()
+            for chunk in iter(lambda: payload.read(DIGEST_CHUNK_SIZE), b""):
+                digester.update(chunk)
+            payload.seek(position)
+            stream = payload
+        else:
+            stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            for chunk in iter(lambda: payload.read(DIGEST_CHUNK_SIZE), b""):
+                digester.update(chunk)
+                stream.write(chunk)
+            stream.seek(0)
+
+        return self.create_warc_record(
+            uri,
+            record_type,
+            payload=stream,
+            length=digester.length,
+            http_headers=http_headers,
+            warc_headers_dict={**(warc_headers_dict or {}), **digester.headers},
+        )
+
+
+def open_warc(filename):
+    """Open a WARC file to be read by `ArchiveIterator`
+
+    gzip is detected by `ArchiveIterator` itself, but Zstandard WARCs are
+    decompressed here (using the dictionary stored in the file, if any).
+    """
+    fobj = open(filename, mode="rb")
+    magic = fobj.read(4)
+    if magic not in (ZSTD_FRAME_MAGIC, ZSTD_DICTIONARY_MAGIC):
+        fobj.seek(0)
+        return fobj
+
+    zstd = import_zstd()
+    zstd_dict = None
+    if magic == ZSTD_DICTIONARY_MAGIC:
+        (size,) = struct.unpack("<I", fobj.read(4))
+        dictionary = fobj.read(size)
+        if dictionary.startswith(ZSTD_FRAME_MAGIC):
+            dictionary = zstd.decompress(dictionary)
+        zstd_dict = zstd.ZstdDict(dictionary)
+    fobj.close()
+    # The skippable frame with the dictionary is ignored by the decompressor
+    return zstd.ZstdFile(filename, mode="rb", zstd_dict=zstd_dict)
+
+
+def iter_records(filenames):
+    """Stream records from many WARC files (each one must be consumed)"""
+    for filename in filenames:
+        with open_warc(filename) as fobj:
+            yield from ArchiveIterator(fobj)
+
+
+def check_digests(chunks, block_digest=None, payload_digest=None, http=False):
+    """Hash a record block (from `chunks`), returning the names of the digests
+    which don't match the expected `(algorithm, digest)` pairs
+
+    If `http`, the payload starts after the HTTP headers inside the block.
+    """
+    block = hashlib.new(block_digest[0]) if block_digest else None
+    payload = hashlib.new(payload_digest[0]) if payload_digest else None
+    head = b"" if http else None  # Buffered until the end of HTTP headers
+    for chunk in chunks:
+        if block is not None:
+            block.update(chunk)
+        if payload is not None:
+            if head is not None:
+                head += chunk
+                position = head.find(b"\r\n\r\n")
+                if position == -1:
+                    continue
+                chunk, head = head[position + 4 :], None
+            payload.update(chunk)
+
+    errors = []
+    if block is not None and block.digest() != block_digest[1]:
+        errors.append("WARC-Block-Digest")
+    if payload is not None and (
+        head is not None or payload.digest() != payload_digest[1]
+    ):
+        errors.append("WARC-Payload-Digest")
+    return errors
+
+
+def _record_digests(record):
+    """Expected digests of a (not parsed) record and invalid digest headers"""
+    digests, errors = {}, []
+    headers = record.rec_headers
+    names = ["WARC-Block-Digest"]
+    if record.rec_type != "revisit":  # Its payload digest is the original's
+        names.append("WARC-Payload-Digest")
+    for name in names:
+        value = headers.get_header(name)
+        if value:
+            try:
+                digests[name] = parse_digest(value)
+            except ValueError:
+                errors.append(name)
+    http = (headers.get_header("Content-Type") or "").startswith("application/http")
+    return (
+        digests.get("WARC-Block-Digest"),
+        digests.get("WARC-Payload-Digest"),
+        http,
+        errors,
+    )
+
+
+def verify_warcs(filenames, jobs=None):
+    """Check the digests of all records in WARC files, using `jobs` threads
+
+    Records are read sequentially (decompression) and hashed in parallel
+    (hashlib releases the GIL). Yield `(filename, offset, record type, URI,
+    errors)` for each record, in order; `errors` lists the digest headers
+    which are invalid or don't match the record.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for filename in filenames:
+            with open_warc(filename) as fobj:
+                iterator = ArchiveIterator(fobj, no_record_parse=True)
+                for record in iterator:
+                    block_digest, payload_digest, http, errors = _record_digests(record)
+                    args = (block_digest, payload_digest, http)
+                    if (block_digest or payload_digest) and (
+                        record.length is not None and record.length <= VERIFY_MAX_BUFFER
+                    ):
+                        chunks = [record.raw_stream.read()]
+                        future = executor.submit(check_digests, chunks, *args)
+                    else:
+                        chunks = iter(
+                            lambda: record.raw_stream.read(DIGEST_CHUNK_SIZE), b""
+                        )
+                        future = Future()
+                        future.set_result(check_digests(chunks, *args))
+                    # Offset is known only after the record is read
+                    info = (
+                        filename,
+                        iterator.get_record_offset(),
+                        record.rec_type,
+                        record.rec_headers.get_header("WARC-Target-URI"),
+                    )
+                    pending.append((info, errors, future))
+                    while len(pending) > jobs * 4:
+                        info, errors, future = pending.popleft()
+                        yield (*info, errors + future.result())
+        while pending:
+            info, errors, future = pending.popleft()
+            yield (*info, errors + future.result())
+
+
+def part_filename(filename, part):
+    """Add `part` number to `filename` (`a.warc.gz` becomes `a-00001.warc.gz`)"""
+    path = Path(filename)
+    suffixes = "".join(path.suffixes)
+    name = path.name[: len(path.name) - len(suffixes)]
+    return str(path.with_name(f"{name}-{part:05d}{suffixes}"))
+
+
+def index_entry(record, filename, offset, length):
+    """Index data (same keys as `warcio index`) for a record already written"""
+    entry = {
+        "offset": offset,
+        "length": length,
+        "filename": Path(filename).name,
+    }
+    for header in ("WARC-Type", "WARC-Target-URI", "WARC-Date"):
+        value = record.rec_headers.get_header(header)
+        if value:
+            entry[header.lower()] = value
+    if record.rec_type in ("response", "revisit"):
+        entry["warc-payload-digest"] = record.rec_headers.get_header(
+            "WARC-Payload-Digest"
+        )
+        if record.http_headers:
+            entry["http:status"] = record.http_headers.get_statuscode()
+            entry["mime"] = record.http_headers.get_header("Content-Type")
+    return entry
+
+
+class WarcMerger:
+    """Write records from many WARCs into size-bounded, compacted WARC files
+
+    - `max_size`: start a new file when current one reaches this size (in
+      bytes), without splitting requests from their responses;
+    - `dedup`: responses with an already written payload (same digest) are
+      written as `revisit` records;
+    - `drop_failed`: responses with 5xx status codes (and their requests) are
+      not written;
+    - `index`: write a JSON lines index (`<output>.index.jsonl`) in the same
+      pass;
+    - `compression`, `level` and `dictionary`: see `WarcWriter`.
+    """
+
+    def __init__(
+        self,
+        filename,
+        max_size=None,
+        dedup=False,
+        drop_failed=False,
+        index=False,
+        compression="gzip",
+        level=None,
+        dictionary=None,
+    ):
+        check_compression_options(compression, level, dictionary)
+        self.filename = filename
+        self.max_size = max_size
+        self.dedup = dedup
+        self.drop_failed = drop_failed
+        self.index = index
+        self.compression = compression
+        self.level = level
+        self.dictionary = dictionary
+        self.filenames = []
+        self.stats = {"records": 0, "revisits": 0, "dropped": 0}
+        self._fobj = self._index_fobj = self._writer = None
+        self._payloads = {}  # Payload digest: (target URI, date) first written
+        self._pending_request = None  # (request record, payload)
+        self._last_type = self._last_uri = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._flush_pending_request()
+        self._close_files()
+
+    def _close_files(self):
+        for fobj in (self._fobj, self._index_fobj):
+            if fobj is not None:
+                fobj.close()
+        self._fobj = self._index_fobj = self._writer = None
+
+    def _open_next_file(self):
+        self._close_files()
+        if self.max_size:
+            filename = part_filename(self.filename, len(self.filenames) + 1)
+        else:
+            filename = self.filename
+        self.filenames.append(filename)
+        self._fobj = open(filename, mode="wb")
+        self._writer = WarcWriter(
+            self._fobj,
+            compression=self.compression,
+            level=self.level,
+            dictionary=self.dictionary,
+        )
+        if self.index:
+            self._index_fobj = open(f"{filename}.index.jsonl", mode="w")
+
+    def _write(self, record):
+        uri = record.rec_headers.get_header("WARC-Target-URI")
+        follows_request = (
+            record.rec_type in ("response", "revisit")
+            and self._last_type == "request"
+            and self._last_uri == uri
+        )
+        if self._fobj is None or (
+            self.max_size and not follows_request and self._fobj.tell() >= self.max_size
+        ):
+            self._open_next_file()
+
+        offset = self._fobj.tell()
+        self._writer.write_record(record)
+        if self._index_fobj is not None:
+            entry = index_entry(
+                record, self.filenames[-1], offset, self._fobj.tell() - offset
+            )
+            self._index_fobj.write(json.dumps(entry) + "\n")
+        self._last_type, self._last_uri = record.rec_type, uri
+        self.stats["records"] += 1
+
+    def _flush_pending_request(self):
+        if self._pending_request is not None:
+            record, payload = self._pending_request
+            self._pending_request = None
+            record.raw_stream = io.BytesIO(payload)
+            self._write(record)
+
+    def _revisit(self, record):
+        """Return a revisit record if `record`'s payload was already written"""
+        # Computes the digest (buffering the payload) only if it's missing
+        self._writer.ensure_digest(record, block=False, payload=True)
+        digest = record.rec_headers.get_header("WARC-Payload-Digest")
+        uri = record.rec_headers.get_header("WARC-Target-URI")
+        date = record.rec_headers.get_header("WARC-Date")
+        if digest not in self._payloads:
+            self._payloads[digest] = (uri, date)
+            return None
+        refers_to_uri, refers_to_date = self._payloads[digest]
+        return self._writer.create_revisit_record(
+            uri,
+            digest,
+            refers_to_uri,
+            refers_to_date,
+            http_headers=record.http_headers,
+            warc_headers_dict={"WARC-Date": date},
+        )
+
+    def write(self, record):
+        """Write (or drop/deduplicate) a record, which is consumed"""
+        if self._writer is None:
+            self._open_next_file()
+
+        if record.rec_type == "request" and self.drop_failed:
+            # Kept until the next record, so it's dropped if the response is
+            # also dropped (requests are small)
+            self._flush_pending_request()
+            self._pending_request = (record, record.raw_stream.read())
+            return
+
+        pending = self._pending_request
+        if record.rec_type == "response":
+            status = record.http_headers.get_statuscode() if record.http_headers else ""
+            if self.drop_failed and status.startswith("5"):
+                self.stats["dropped"] += 1
+                uri = record.rec_headers.get_header("WARC-Target-URI")
+                if pending is not None and (
+                    pending[0].rec_headers.get_header("WARC-Target-URI") == uri
+                ):
+                    self._pending_request = None
+                    self.stats["dropped"] += 1
+                return
+
+            if self.dedup:
+                revisit = self._revisit(record)
+                if revisit is not None:
+                    self.stats["revisits"] += 1
+                    record = revisit
+
+        self._flush_pending_request()
+        self._write(record)
+
+
+def merge_warcs(input_filenames, output_filename, **kwargs):
+    """Merge WARC files (see `WarcMerger`), returning the stats and filenames"""
+    with WarcMerger(output_filename, **kwargs) as merger:
+        for record in iter_records(input_filenames):
+            merger.write(record)
+    return merger.stats, merger.filenames
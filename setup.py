@@ -8,6 +8,7 @@ setup(
     author_email="alvarojusten@gmail.com",
     url="https://github.com/turicas/crau/",
     install_requires=["click", "pywb", "scrapy", "tqdm", "warcio"],
+    extras_require={"zstd": ["backports.zstd; python_version < '3.14'"]},
     packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests"]),
     keywords="web crawling scraping archiving",
     entry_points={"console_scripts": ["crau = crau.cli:cli"]},
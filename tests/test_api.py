@@ -0,0 +1,83 @@
+import json
+import subprocess
+import sys
+import textwrap
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from crau.utils import WarcReader
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def run_jobs(filenames, url):
+    """Archive `url` in a new interpreter (which installs its own reactor)
+
+    Each item of `filenames` is a list of WARC filenames archived concurrently
+    by one `asyncio.run` call, returning the stats of each job.
+    """
+    code = textwrap.dedent(f"""
+        import asyncio
+        import json
+        from crau.api import archive_async
+
+        async def main(filenames):
+            return await asyncio.gather(
+                *[archive_async(filename, [{url!r}]) for filename in filenames]
+            )
+
+        results = []
+        for filenames in {filenames!r}:
+            results.extend(asyncio.run(main(filenames)))
+        print(json.dumps(results, default=str))
+        """)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_archive_async_concurrent_jobs(tmp_path):
+    site = tmp_path / "site"
+    site.mkdir()
+    (site / "index.html").write_text(
+        '<html><head><link rel="stylesheet" href="/style.css"></head>'
+        '<body><img src="/logo.png"></body></html>'
+    )
+    (site / "style.css").write_text("body { background: url(bg.png) }")
+    (site / "logo.png").write_bytes(b"logo")
+    (site / "bg.png").write_bytes(b"bg")
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(QuietHandler, directory=str(site))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/index.html"
+
+    # Concurrent jobs in one event loop, then another job in a new loop
+    filenames = [str(tmp_path / f"job-{index}.warc.gz") for index in range(4)]
+    try:
+        results = run_jobs([filenames[:3], filenames[3:]], url)
+    finally:
+        server.shutdown()
+
+    expected = {url} | {
+        url.replace("index.html", name) for name in ("style.css", "logo.png", "bg.png")
+    }
+    assert len(results) == len(filenames)
+    for filename, stats in zip(filenames, results):
+        assert stats["response_received_count"] == 4
+        warc = WarcReader(filename)
+        uris = {
+            record.rec_headers.get_header("WARC-Target-URI")
+            for record in warc
+            if record.rec_type == "response"
+        }
+        assert uris == expected
@@ -0,0 +1,112 @@
+import time
+
+from scrapy import Spider
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+
+from crau.cache import SqliteCacheStorage
+
+
+def get_storage(tmp_path, **settings):
+    settings = Settings({"HTTPCACHE_DIR": str(tmp_path), **settings})
+    storage = SqliteCacheStorage(settings)
+    storage.open_spider(Spider(name="test"))
+    return storage
+
+
+def store(storage, url, body=b"<html></html>"):
+    request = Request(url)
+    response = HtmlResponse(
+        url, body=body, headers={"Content-Type": "text/html"}, request=request
+    )
+    storage.store_response(None, request, response)
+    return request
+
+
+def test_sqlite_cache_storage_store_and_retrieve(tmp_path):
+    for use_gzip in (False, True):
+        storage = get_storage(tmp_path, HTTPCACHE_GZIP=use_gzip)
+        request = store(storage, "http://example.com/page", b"<p>cached</p>")
+        response = storage.retrieve_response(None, request)
+        assert isinstance(response, HtmlResponse)
+        assert response.body == b"<p>cached</p>"
+        assert response.headers["Content-Type"] == b"text/html"
+        assert response.status == 200
+        # Same canonicalized URL is a cache hit
+        same_request = Request("HTTP://EXAMPLE.COM:80/page#top")
+        assert storage.retrieve_response(None, same_request).body == response.body
+        assert storage.retrieve_response(None, Request("http://example.com/")) is None
+        storage.close_spider(None)
+
+    # Responses are persisted when spider is closed
+    storage = get_storage(tmp_path)
+    assert storage.retrieve_response(None, request).body == b"<p>cached</p>"
+    storage.close_spider(None)
+
+
+def test_sqlite_cache_storage_expiration(tmp_path):
+    storage = get_storage(tmp_path, HTTPCACHE_EXPIRATION_SECS=60)
+    request = store(storage, "http://example.com/page")
+    assert storage.retrieve_response(None, request) is not None
+    assert storage.flush()
+    storage.connection.execute(
+        "UPDATE response SET created_at = ?", (time.time() - 61,)
+    )
+    assert storage.retrieve_response(None, request) is None
+    storage.close_spider(None)
+
+
+def test_sqlite_cache_storage_evicts_oldest(tmp_path):
+    storage = get_storage(tmp_path, CRAU_HTTPCACHE_MAX_SIZE=3000)
+    requests = [store(storage, f"http://example.com/{i}", b"x" * 900) for i in range(5)]
+    assert storage.size <= 3000
+    assert storage.retrieve_response(None, requests[0]) is None
+    assert storage.retrieve_response(None, requests[-1]) is not None
+    storage.close_spider(None)
+
+
+def test_sqlite_cache_storage_shared_by_many_crawls(tmp_path):
+    first, second = get_storage(tmp_path), get_storage(tmp_path)
+    first_request = store(first, "http://example.com/1", b"first")
+    # First storage has a buffered response, but doesn't hold the write lock
+    second.commit_every = 1
+    second_request = store(second, "http://example.com/2", b"second")
+    assert not second._pending
+    assert first.retrieve_response(None, second_request).body == b"second"
+    assert first.retrieve_response(None, first_request).body == b"first"
+    first.close_spider(None)
+    second.close_spider(None)
+
+    storage = get_storage(tmp_path)
+    assert storage.retrieve_response(None, first_request).body == b"first"
+    assert storage.retrieve_response(None, second_request).body == b"second"
+    storage.close_spider(None)
+
+
+def test_sqlite_cache_storage_max_size_shared_by_many_crawls(tmp_path):
+    first = get_storage(tmp_path, CRAU_HTTPCACHE_MAX_SIZE=3000)
+    second = get_storage(tmp_path, CRAU_HTTPCACHE_MAX_SIZE=3000)
+    first.commit_every = second.commit_every = 1
+    requests = [
+        store(storage, f"http://example.com/{index}", b"x" * 900)
+        for index, storage in enumerate((first, second) * 3)
+    ]
+    # Each storage wrote 3 responses, but their sum is above max size
+    total = first.connection.execute("SELECT SUM(size) FROM response").fetchone()[0]
+    assert total <= 3000
+    assert first.retrieve_response(None, requests[0]) is None
+    assert first.retrieve_response(None, requests[-1]) is not None
+    first.close_spider(None)
+    second.close_spider(None)
+
+
+def test_sqlite_cache_storage_waits_for_other_writers(tmp_path):
+    first, second = get_storage(tmp_path), get_storage(tmp_path)
+    request = store(first, "http://example.com/1")
+    second.connection.execute("BEGIN IMMEDIATE")  # Another writer
+    assert not first.flush()  # Doesn't block, response is kept in memory
+    assert first.retrieve_response(None, request) is not None
+    second.connection.execute("COMMIT")
+    assert first.flush()
+    first.close_spider(None)
+    second.close_spider(None)
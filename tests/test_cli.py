@@ -0,0 +1,31 @@
+from click.testing import CliRunner
+
+from crau.cli import cli
+
+
+def test_invalid_compression_options_dont_create_files(tmp_path):
+    site = tmp_path / "site"
+    site.mkdir()
+    (site / "index.html").write_text("<html></html>")
+    dictionary = tmp_path / "dictionary"
+    dictionary.write_bytes(b"dictionary")
+    runner = CliRunner()
+    for command, filename, options, hint in (
+        ("pack", "p.warc.gz", ["--compression-level", "15"], "--compression-level"),
+        ("pack", "p.warc.zst", ["--compression-level", "23"], "--compression-level"),
+        ("pack", "p.warc", ["--compression-level", "1"], "--compression-level"),
+        ("pack", "p.warc.gz", ["--zstd-dictionary", dictionary], "--zstd-dictionary"),
+        ("archive", "a.warc.gz", ["--compression-level", "0"], "--compression-level"),
+        ("merge", "m.warc", ["--zstd-dictionary", dictionary], "--zstd-dictionary"),
+    ):
+        output = tmp_path / filename
+        if command == "pack":
+            args = [command, *map(str, options), "https://example.com/", site, output]
+        elif command == "archive":
+            args = [command, *map(str, options), output, "https://example.com/"]
+        else:
+            args = [command, *map(str, options), output, site / "index.html"]
+        result = runner.invoke(cli, [str(arg) for arg in args])
+        assert result.exit_code == 2, args
+        assert hint in result.output, args
+        assert not output.exists(), args
@@ -0,0 +1,159 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+from crau.robots import RobotsMiddleware
+from crau.spider import CrauSpider, RequestInfo
+from crau.warc import WarcWriter
+
+
+class FakeEngine:
+    """Engine keeping downloads (to be answered by the test) and crawls"""
+
+    def __init__(self):
+        self.downloader = SimpleNamespace(per_slot_settings={}, slots={})
+        self.downloads = []
+        self.crawled = []
+
+    def download(self, request):
+        deferred = Deferred()
+        self.downloads.append((request, deferred))
+        return deferred
+
+    def crawl(self, request):
+        self.crawled.append(request)
+
+
+def get_middleware(**settings):
+    crawler = get_crawler(CrauSpider, settings)
+    crawler.engine = FakeEngine()
+    spider = CrauSpider.from_crawler(crawler, warc_filename=None, urls=[])
+    spider.warc_writer = WarcWriter(io.BytesIO())
+    return RobotsMiddleware.from_crawler(crawler), spider
+
+
+def respond(engine, body=b"", status=200):
+    request, deferred = engine.downloads.pop(0)
+    deferred.callback(
+        HtmlResponse(
+            request.url,
+            status=status,
+            body=body,
+            request=request,
+            protocol="HTTP/1.1",
+        )
+    )
+    return request
+
+
+def get_results(deferreds):
+    results = []
+    for deferred in deferreds:
+        deferred.addCallbacks(results.append, lambda failure: results.append(failure))
+    return results
+
+
+def test_not_configured():
+    crawler = get_crawler(CrauSpider)
+    with pytest.raises(NotConfigured):
+        RobotsMiddleware.from_crawler(crawler)
+
+
+def test_robots_txt_is_fetched_once_per_origin():
+    middleware, spider = get_middleware(CRAU_ROBOTSTXT_OBEY=True, CRAU_SITEMAPS=True)
+    spider._seed_origins.add("https://example.com")
+    engine = spider.crawler.engine
+    requests = [
+        spider.make_request(url=f"https://example.com/{path}", callback=spider.parse)
+        for path in ("", "private/page", "public")
+    ]
+    # Requests wait for robots.txt in the downloader
+    deferreds = [middleware.process_request(request, spider) for request in requests]
+    results = get_results(deferreds)
+    assert [request.url for request, _ in engine.downloads] == [
+        "https://example.com/robots.txt"
+    ]
+    assert results == []
+
+    respond(
+        engine,
+        b"User-agent: *\nDisallow: /private\nCrawl-delay: 2\n"
+        b"Sitemap: https://example.com/sitemap-index.xml\n",
+    )
+    assert results[0] is None and results[2] is None
+    assert results[1].check(IgnoreRequest)
+    assert [request.url for request in engine.crawled] == [
+        "https://example.com/sitemap-index.xml"
+    ]
+    assert engine.crawled[0].callback == spider.parse_sitemap
+    assert engine.downloader.per_slot_settings == {"example.com": {"delay": 2.0}}
+    assert spider.crawler.stats.get_value("crau/robots_denied") == 1
+
+    # Cached policy is used for the next requests
+    request = spider.make_request(url="https://example.com/private/2")
+    with pytest.raises(IgnoreRequest):
+        middleware.process_request(request, spider)
+    request = spider.make_request(url="https://example.com/2")
+    assert middleware.process_request(request, spider) is None
+    assert engine.downloads == []
+
+
+def test_robots_txt_redirect_and_error():
+    middleware, spider = get_middleware(CRAU_ROBOTSTXT_OBEY=True)
+    engine = spider.crawler.engine
+    request = spider.make_request(url="http://example.com/page")
+    results = get_results([middleware.process_request(request, spider)])
+    robots_request, deferred = engine.downloads.pop(0)
+    deferred.callback(
+        HtmlResponse(
+            robots_request.url,
+            status=301,
+            headers={"Location": "https://example.com/robots.txt"},
+            request=robots_request,
+            protocol="HTTP/1.1",
+        )
+    )
+    assert results == []
+    robots_request, deferred = engine.downloads.pop(0)
+    assert robots_request.url == "https://example.com/robots.txt"
+    deferred.errback(ConnectionError("refused"))
+    assert results == [None]  # Unavailable robots.txt allows everything
+
+
+def test_sitemaps_are_discovered_only_for_seeds():
+    middleware, spider = get_middleware(CRAU_SITEMAPS=True, CRAU_ROBOTSTXT_OBEY=True)
+    spider.allowed_uris = ["https://blog.example.com/"]
+    spider._seed_origins.add("https://example.com")
+    engine = spider.crawler.engine
+    info = RequestInfo(1, "https://example.com/")
+    for url, sitemap_urls in (
+        ("https://example.com/", ["https://example.com/sitemap.xml"]),
+        ("https://blog.example.com/", ["https://blog.example.com/sitemap.xml"]),
+        ("https://example.org/", []),
+    ):
+        (request,) = spider.collect_link(info, "anchor", url)
+        middleware.process_request(request, spider)
+        assert respond(engine).url == url + "robots.txt"
+        assert [request.url for request in engine.crawled] == sitemap_urls
+        engine.crawled.clear()
+
+    # Without `--robots`, robots.txt isn't requested for other origins and
+    # requests don't wait for it
+    middleware, spider = get_middleware(CRAU_SITEMAPS=True)
+    spider._seed_origins.add("https://example.com")
+    engine = spider.crawler.engine
+    for link_type, url in (
+        ("anchor", "https://example.org/"),
+        ("media", "https://cdn.example.net/1.png"),
+        ("anchor", "https://example.com/"),
+    ):
+        (request,) = spider.collect_link(info, link_type, url)
+        assert middleware.process_request(request, spider) is None
+    assert [request.url for request, _ in engine.downloads] == [
+        "https://example.com/robots.txt"
+    ]
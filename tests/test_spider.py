@@ -0,0 +1,280 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import StopDownload
+from scrapy.http import Headers, HtmlResponse, Request
+from scrapy.utils.request import request_from_dict
+from scrapy.utils.test import get_crawler
+
+from crau.spider import CrauSpider, RequestInfo
+from crau.warc import WarcWriter
+
+
+def get_spider(**kwargs):
+    crawler = get_crawler(CrauSpider)
+    spider = CrauSpider.from_crawler(crawler, warc_filename=None, urls=[], **kwargs)
+    spider.warc_writer = WarcWriter(io.BytesIO())
+    return spider
+
+
+def get_response(spider, url, status=200, headers=None, body=b"", chain=()):
+    request = spider.make_request(
+        url=url, callback=spider.parse, info=RequestInfo(0, url, chain)
+    )
+    return HtmlResponse(
+        url,
+        status=status,
+        headers={"Content-Type": "text/html", **(headers or {})},
+        body=body,
+        request=request,
+        protocol="HTTP/1.1",
+    )
+
+
+def test_redirect_body_is_not_parsed():
+    spider = get_spider()
+    response = get_response(
+        spider,
+        "https://example.com/old",
+        status=301,
+        headers={"Location": "/new"},
+        body=b'<a href="/moved">Moved</a><img src="/logo.png">',
+    )
+    requests = list(spider.parse(response))
+    assert [request.url for request in requests] == ["https://example.com/new"]
+    assert requests[0].callback == spider.parse
+    assert requests[0].info.depth == 0
+    assert requests[0].info.redirect_chain == ("https://example.com/old",)
+
+
+def test_redirect_loop_and_max_redirects():
+    spider = get_spider(max_redirects=2)
+    response = get_response(
+        spider,
+        "https://example.com/b",
+        status=302,
+        headers={"Location": "https://example.com/a"},
+        chain=("https://example.com/a",),
+    )
+    assert list(spider.parse(response)) == []
+
+    response = get_response(
+        spider,
+        "https://example.com/3",
+        status=302,
+        headers={"Location": "https://example.com/4"},
+        chain=("https://example.com/1", "https://example.com/2"),
+    )
+    assert list(spider.parse(response)) == []
+
+
+def test_redirect_to_https_is_cached_per_host():
+    spider = get_spider()
+    response = get_response(
+        spider,
+        "http://example.com/1",
+        status=301,
+        headers={"Location": "https://example.com/1"},
+    )
+    assert [request.url for request in spider.parse(response)] == [
+        "https://example.com/1"
+    ]
+    # Each redirecting URL is requested only once, other ones aren't rewritten
+    assert spider.make_request(url="http://example.com/1") is None
+    info = RequestInfo(1, "https://example.com/1")
+    requests = spider.collect_link(info, "anchor", "http://example.com/2")
+    assert [request.url for request in requests] == ["http://example.com/2"]
+
+
+def test_upgrade_https():
+    spider = get_spider()
+    spider.upgrade_https = True
+    response = get_response(
+        spider,
+        "http://example.com/1",
+        status=301,
+        headers={"Location": "https://example.com/1"},
+    )
+    list(spider.parse(response))
+    # Links from the same host are requested directly using HTTPS
+    info = RequestInfo(1, "https://example.com/1")
+    (request,) = spider.collect_link(info, "anchor", "http://example.com/2")
+    assert request.url == "https://example.com/2"
+    assert spider.collect_link(info, "anchor", "https://example.com/2") == [None]
+    (request,) = spider.collect_link(info, "anchor", "http://example.org/")
+    assert request.url == "http://example.org/"
+    # Seeds are never rewritten
+    request = spider.make_request(
+        url="http://example.com/3",
+        callback=spider.parse,
+        info=RequestInfo(0, "http://example.com/3"),
+    )
+    assert request.url == "http://example.com/3"
+
+
+def test_headers_received_content_type_policy():
+    crawler = get_crawler(
+        CrauSpider,
+        {
+            "CRAU_CONTENT_TYPE_DENY": ["video/*"],
+            "CRAU_CONTENT_TYPE_MAXSIZE": {"image/*": 1024},
+        },
+    )
+    spider = CrauSpider.from_crawler(crawler, warc_filename=None, urls=[])
+    request = Request("https://example.com/movie")
+    with pytest.raises(StopDownload):
+        spider.headers_received(
+            Headers({"Content-Type": "video/mp4"}), 10**9, request, spider
+        )
+    assert crawler.stats.get_value("crau/content_type_denied") == 1
+
+    request = Request("https://example.com/image")
+    spider.headers_received(Headers({"Content-Type": "image/png"}), -1, request, spider)
+    assert request.meta["download_maxsize"] == 1024
+    request = Request("https://example.com/")
+    spider.headers_received(Headers({"Content-Type": "text/html"}), -1, request, spider)
+    assert "download_maxsize" not in request.meta
+
+
+def test_robots_and_sitemaps_ignore_content_type_policy():
+    crawler = get_crawler(
+        CrauSpider,
+        {"CRAU_ROBOTSTXT_OBEY": True, "CRAU_CONTENT_TYPE_ALLOW": ["text/html"]},
+    )
+    spider = CrauSpider.from_crawler(crawler, warc_filename=None, urls=[])
+    headers = Headers({"Content-Type": "text/plain"})
+    request = spider.make_request(url="https://example.com/file.txt")
+    with pytest.raises(StopDownload):
+        spider.headers_received(headers, -1, request, spider)
+    request = spider.robots_request(
+        "https://example.com/robots.txt", "https://example.com"
+    )
+    spider.headers_received(headers, -1, request, spider)
+    request = spider.sitemap_request("https://example.com/sitemap.xml")
+    headers = Headers({"Content-Type": "application/xml"})
+    spider.headers_received(headers, -1, request, spider)
+
+
+def test_binary_body_is_not_parsed():
+    spider = get_spider()
+    response = get_response(
+        spider, "https://example.com/file", body=b'\x00\x01<a href="/link">'
+    )
+    assert list(spider.parse(response)) == []
+
+
+def test_duplicate_payloads_are_counted():
+    spider = get_spider()
+    for url, body in (
+        ("https://example.com/logo.png", b"logo"),
+        ("https://example.com/static/logo.png", b"logo"),
+        ("https://example.com/icon.png", b"icon"),
+    ):
+        spider.write_warc(get_response(spider, url, body=body))
+    stats = spider.crawler.stats
+    assert stats.get_value("crau/duplicate_payload_count") == 1
+    assert stats.get_value("crau/duplicate_payload_bytes") == 4
+
+
+def get_crawler_spider(**settings):
+    crawler = get_crawler(CrauSpider, settings)
+    crawler.engine = SimpleNamespace(
+        downloader=SimpleNamespace(per_slot_settings={}, slots={})
+    )
+    spider = CrauSpider.from_crawler(crawler, warc_filename=None, urls=[])
+    spider.warc_writer = WarcWriter(io.BytesIO())
+    return spider
+
+
+def test_start_requests_are_lazy(tmp_path):
+    crawler = get_crawler(CrauSpider, {"CRAU_SITEMAPS": True})
+    read = []
+
+    def seeds():
+        for index in range(1000):
+            read.append(index)
+            yield f"https://example.com/{index}"
+
+    spider = CrauSpider.from_crawler(
+        crawler, warc_filename=str(tmp_path / "archive.warc.gz"), urls=seeds()
+    )
+    requests = spider.start_requests()
+    assert [next(requests).url for _ in range(2)] == [
+        "https://example.com/0",
+        "https://example.com/1",
+    ]
+    assert read == [0, 1]
+    spider.warc_fobj.close()
+
+
+def test_parse_sitemap():
+    spider = get_crawler_spider(CRAU_SITEMAPS=True)
+    request = spider.sitemap_request("https://example.com/sitemap.xml")
+    response = HtmlResponse(
+        request.url,
+        headers={"Content-Type": "application/xml"},
+        body=(
+            b'<?xml version="1.0"?>'
+            b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            b"<sitemap><loc>https://example.com/pages.xml</loc></sitemap>"
+            b"<sitemap><loc>https://example.org/other.xml</loc></sitemap>"
+            b"</sitemapindex>"
+        ),
+        request=request,
+        protocol="HTTP/1.1",
+    )
+    requests = list(spider.parse_sitemap(response))
+    assert [request.url for request in requests] == ["https://example.com/pages.xml"]
+
+    response = HtmlResponse(
+        requests[0].url,
+        headers={"Content-Type": "application/xml"},
+        body=(
+            b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            b"<url><loc>https://example.com/page-1</loc></url>"
+            b"<url><loc>https://example.com/page-2</loc></url>"
+            b"</urlset>"
+        ),
+        request=requests[0],
+        protocol="HTTP/1.1",
+    )
+    requests = list(spider.parse_sitemap(response))
+    assert [(request.url, request.info.depth) for request in requests] == [
+        ("https://example.com/page-1", 0),
+        ("https://example.com/page-2", 0),
+    ]
+    assert all(request.callback == spider.parse for request in requests)
+
+
+def test_requests_from_same_page_share_request_info():
+    spider = get_spider(max_depth=1)
+    response = get_response(
+        spider,
+        "https://example.com/",
+        body=(
+            b'<img src="/1.png"><img src="/2.png"><style>a { color: red }</style>'
+            b'<a href="/page-1">1</a><a href="/page-2">2</a>'
+        ),
+    )
+    requests = {request.url: request for request in spider.parse(response)}
+    infos = {url: request.info for url, request in requests.items()}
+    assert infos["https://example.com/1.png"] is infos["https://example.com/2.png"]
+    assert infos["https://example.com/page-1"] is infos["https://example.com/page-2"]
+    assert infos["https://example.com/1.png"].depth == 0
+    assert infos["https://example.com/page-1"].depth == 1
+    assert infos["https://example.com/page-1"].main_url == "https://example.com/"
+    assert not any(request.meta for request in requests.values())
+
+
+def test_crau_request_serialization():
+    # Used by scrapy's disk queues (`JOBDIR`) and `Request.replace`
+    spider = get_spider()
+    request = spider.make_request(
+        url="https://example.com/", callback=spider.parse, info=RequestInfo(2, "u")
+    )
+    copy = request_from_dict(request.to_dict(spider=spider), spider=spider)
+    assert type(copy) is type(request)
+    assert copy.callback == spider.parse
+    assert (copy.info.depth, copy.info.main_url) == (2, "u")
+    assert request.replace(url="https://example.com/2").info is request.info
@@ -0,0 +1,64 @@
+import io
+import subprocess
+import sys
+import textwrap
+import time
+
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+# Slow imports (hundreds of ms) which read-only commands must not pay for
+SLOW_MODULES = ("scrapy", "twisted", "tqdm", "crau.spider", "crau.api")
+MAX_STARTUP_SECONDS = 5
+
+
+def create_warc(filename):
+    with open(filename, mode="wb") as fobj:
+        writer = WARCWriter(fobj, gzip=True)
+        http_headers = StatusAndHeaders(
+            "200 OK", [("Content-Type", "text/plain")], protocol="HTTP/1.1"
+        )
+        writer.write_record(
+            writer.create_warc_record(
+                "https://example.com/",
+                "response",
+                payload=io.BytesIO(b"archived"),
+                http_headers=http_headers,
+            )
+        )
+
+
+def run_cli(*args):
+    """Run crau's CLI in a new interpreter, returning output and slow imports"""
+    code = textwrap.dedent(f"""
+        import sys
+        from crau.cli import cli
+        try:
+            cli({list(args)!r})
+        except SystemExit:
+            pass
+        slow = [name for name in sys.modules if name.split(".")[0] in {SLOW_MODULES!r} or name in {SLOW_MODULES!r}]
+        print("SLOW_MODULES:", ",".join(sorted(slow)))
+        """)
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    elapsed = time.time() - start
+    output, _, slow_modules = result.stdout.rpartition("SLOW_MODULES: ")
+    return output, slow_modules.strip(), elapsed
+
+
+def test_read_only_commands_start_fast(tmp_path):
+    warc_filename = str(tmp_path / "archive.warc.gz")
+    create_warc(warc_filename)
+
+    for args, expected_output in (
+        (["--version"], "crau, version"),
+        (["list", warc_filename], "https://example.com/"),
+        (["extract", warc_filename, "https://example.com/", "-"], "archived"),
+    ):
+        output, slow_modules, elapsed = run_cli(*args)
+        assert expected_output in output, args
+        assert slow_modules == "", args
+        assert elapsed < MAX_STARTUP_SECONDS, args
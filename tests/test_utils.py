@@ -1,4 +1,24 @@
-from crau.utils import resource_matches_base_url
+import gzip
+import io
+
+from crau.utils import (
+    ContentTypePolicy,
+    canonicalize_url,
+    detect_css_encoding,
+    extract_css_urls,
+    extract_js_urls,
+    get_urls_from_file,
+    iter_chunks,
+    iter_sitemap_urls,
+    looks_binary,
+    media_type,
+    normalize_seed_url,
+    parse_srcset,
+    resource_matches_base_url,
+    shard_urls,
+    url_fingerprint,
+    url_shard,
+)
 
 
 def test_resource_matches_base_url_empty_allowed_list():
@@ -72,3 +92,192 @@ def test_resource_matches_base_url_miscelaneous_allowed():
     allowed = ["example.com/path", "twitter.com/profile"]
     for url, match_ in urls:
         assert resource_matches_base_url(url, allowed) is match_, url
+
+
+def test_canonicalize_url():
+    urls = [
+        ("https://example.com", "https://example.com/"),
+        ("HTTPS://Example.COM/Path", "https://example.com/Path"),
+        ("http://example.com:80/page#section", "http://example.com/page"),
+        ("https://example.com:443/", "https://example.com/"),
+        ("https://example.com:8443/", "https://example.com:8443/"),
+        ("http://example.com/?b=2&a=1&c", "http://example.com/?a=1&b=2&c"),
+        ("http://User@Example.com/", "http://User@example.com/"),
+        ("http://[::1/", "http://[::1/"),
+    ]
+    for url, expected in urls:
+        assert canonicalize_url(url) == expected, url
+
+
+def test_url_fingerprint():
+    url = canonicalize_url("http://example.com/?a=1")
+    fingerprint = url_fingerprint(url)
+    assert len(fingerprint) == 16
+    assert fingerprint == url_fingerprint(canonicalize_url("HTTP://EXAMPLE.COM?a=1#x"))
+    assert fingerprint == url_fingerprint(url, method="get")
+    assert fingerprint != url_fingerprint(url, method="POST")
+    assert fingerprint != url_fingerprint(url, body=b"data")
+    assert url_fingerprint("http://a/b", "POST", b"c") != url_fingerprint(
+        "http://a/bc", "POST", b""
+    )
+
+
+def test_parse_srcset():
+    assert parse_srcset("") == []
+    assert parse_srcset("image.jpg") == ["image.jpg"]
+    assert parse_srcset("a.jpg 1x, b.jpg 2x") == ["a.jpg", "b.jpg"]
+    assert parse_srcset(" a.jpg 480w,b.jpg,  c.jpg 800w ") == [
+        "a.jpg",
+        "b.jpg",
+        "c.jpg",
+    ]
+    assert parse_srcset("data:image/png;base64,AAA= 1x") == [
+        "data:image/png;base64,AAA="
+    ]
+
+
+def test_extract_js_urls():
+    code = """
+        var app = "/static/app.js", css = '../style.css?v=2';
+        var img = `https://example.com/img/logo.png`, page = "/about";
+        var cdn = "https://cdn.example.net/lib.js", text = 'hello world';
+        var broken = "/never/closed.js
+    """
+    assert extract_js_urls(code, "https://example.com/dir/page.html") == [
+        "https://example.com/static/app.js",
+        "https://example.com/style.css?v=2",
+        "https://example.com/img/logo.png",
+    ]
+
+
+def test_detect_css_encoding():
+    assert detect_css_encoding(b"a { color: red }") == "utf-8"
+    assert detect_css_encoding(b'@charset "ISO-8859-1";') == "iso8859-1"
+    assert detect_css_encoding(b'@charset "unknown";') == "utf-8"
+    assert detect_css_encoding(b'@charset "utf-16";') == "utf-8"
+    assert detect_css_encoding("a {}".encode("utf-16")) == "utf-16"
+    assert detect_css_encoding(b"\xef\xbb\xbfa {}") == "utf-8-sig"
+
+
+def test_extract_css_urls():
+    css = b"""
+        @import "first.css";
+        @import url('second.css') screen;
+        body { background: url( "/images/bg.png" ) }
+        .icon { background: url(icon.svg) }
+        .logo { background-image: -webkit-image-set(url(a.png) 1x, "b.png" 2x) }
+        .new { background-image: image-set("c.avif" type("image/avif"), 'd.jpg') }
+        @font-face { src: url(data:font/woff2;base64,AAAA) }
+        .empty { background: url() }
+    """
+    expected = [
+        ("css", "first.css"),
+        ("css", "second.css"),
+        ("media", "/images/bg.png"),
+        ("media", "icon.svg"),
+        ("media", "a.png"),
+        ("media", "b.png"),
+        ("media", "c.avif"),
+        ("media", "d.jpg"),
+    ]
+    assert list(extract_css_urls(iter_chunks(css))) == expected
+    assert list(extract_css_urls(iter_chunks(memoryview(css), 3))) == expected
+    assert list(extract_css_urls([])) == []
+
+
+def test_extract_css_urls_big_stylesheet_in_chunks():
+    css = b"".join(
+        b".c%d { background: url(img-%d.png) }\n" % (i, i) for i in range(5000)
+    )
+    urls = list(extract_css_urls(iter_chunks(css, 1000)))
+    assert urls == [("media", f"img-{i}.png") for i in range(5000)]
+
+
+def test_extract_css_urls_encoding():
+    css = '@charset "latin1";\n.a { background: url(café.png) }'
+    assert list(extract_css_urls([css.encode("latin1")])) == [("media", "café.png")]
+    css = ".a { background: url(café.png) }"
+    for encoding in ("utf-8", "utf-8-sig", "utf-16", "utf-32"):
+        data = css.encode(encoding)
+        assert list(extract_css_urls(iter_chunks(data, 5))) == [("media", "café.png")]
+
+
+def test_normalize_seed_url():
+    assert normalize_seed_url("  https://example.com/  \n") == "https://example.com/"
+    assert normalize_seed_url("example.com/page") == "http://example.com/page"
+    assert normalize_seed_url("   \n") is None
+    assert normalize_seed_url("# https://example.com/") is None
+
+
+def test_get_urls_from_file(tmp_path):
+    content = "# Seeds\n\nhttps://example.com/\n  example.org  \n"
+    expected = ["https://example.com/", "http://example.org"]
+    filename = tmp_path / "urls.txt"
+    filename.write_text(content)
+    assert list(get_urls_from_file(str(filename))) == expected
+    filename = tmp_path / "urls.txt.gz"
+    with gzip.open(filename, mode="wt") as fobj:
+        fobj.write(content)
+    assert list(get_urls_from_file(str(filename))) == expected
+
+
+def test_shard_urls():
+    urls = [f"https://example.com/{i}" for i in range(1000)]
+    shards = [list(shard_urls(urls, shard, 4)) for shard in range(1, 5)]
+    assert sorted(url for shard in shards for url in shard) == sorted(urls)
+    assert all(150 < len(shard) < 350 for shard in shards)
+    # Same canonical URL, same shard
+    assert url_shard("https://example.com/1", 4) == url_shard(
+        "HTTPS://EXAMPLE.COM:443/1#fragment", 4
+    )
+
+
+def test_media_type_and_looks_binary():
+    assert media_type(b"Text/HTML; charset=utf-8") == "text/html"
+    assert media_type(None) == ""
+    assert looks_binary(b"\x89PNG\r\n\x1a\n\x00\x00")
+    assert not looks_binary(b"<html></html>")
+    assert not looks_binary("<html>".encode("utf-16"))
+
+
+def test_content_type_policy():
+    policy = ContentTypePolicy()
+    assert not policy
+    assert policy.decide("video/mp4") == (True, None)
+
+    policy = ContentTypePolicy(
+        deny=["video/*"],
+        max_sizes={"image/*": 100, "image/svg+xml": 10, "*": 1000},
+    )
+    assert policy
+    assert policy.decide("video/mp4") == (False, 1000)
+    assert policy.decide("image/png") == (True, 100)
+    assert policy.decide("image/svg+xml") == (True, 10)
+    assert policy.decide("text/html") == (True, 1000)
+
+    policy = ContentTypePolicy(allow=["text/*", "application/javascript"])
+    assert policy.decide("text/css") == (True, None)
+    assert policy.decide("application/zip") == (False, None)
+    assert policy.decide("") == (True, None)
+
+
+def test_iter_sitemap_urls():
+    sitemap = (
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        b"<url><loc> https://example.com/1 </loc><lastmod>2020-01-01</lastmod></url>"
+        b"<url><loc>https://example.com/2</loc></url>"
+        b"</urlset>"
+    )
+    expected = [("url", "https://example.com/1"), ("url", "https://example.com/2")]
+    assert list(iter_sitemap_urls(io.BytesIO(sitemap))) == expected
+    assert list(iter_sitemap_urls(io.BytesIO(gzip.compress(sitemap)))) == expected
+
+    index = (
+        b"<sitemapindex><sitemap><loc>https://example.com/s.xml</loc></sitemap>"
+        b"</sitemapindex>"
+    )
+    assert list(iter_sitemap_urls(io.BytesIO(index))) == [
+        ("sitemap", "https://example.com/s.xml")
+    ]
+    assert list(iter_sitemap_urls(io.BytesIO(b"<html>Not found"))) == []
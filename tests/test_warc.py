@@ -0,0 +1,282 @@
+import base64
+import hashlib
+import io
+import json
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from crau.utils import WarcReader
+from crau.warc import (
+    WarcWriter,
+    check_compression_options,
+    guess_compression,
+    import_zstd,
+    iter_records,
+    merge_warcs,
+    parse_digest,
+    part_filename,
+    verify_warcs,
+)
+
+
+def create_warc(filename, responses):
+    with open(filename, mode="wb") as fobj:
+        writer = WARCWriter(fobj, gzip=True)
+        for url, status, body in responses:
+            path = url[url.find("/", 8) :]
+            writer.write_record(
+                writer.create_warc_record(
+                    url,
+                    "request",
+                    http_headers=StatusAndHeaders(
+                        f"GET {path} HTTP/1.1", [], is_http_request=True
+                    ),
+                )
+            )
+            writer.write_record(
+                writer.create_warc_record(
+                    url,
+                    "response",
+                    payload=io.BytesIO(body),
+                    http_headers=StatusAndHeaders(
+                        f"{status} Status", [], protocol="HTTP/1.1"
+                    ),
+                )
+            )
+
+
+def read_records(filename):
+    with open(filename, mode="rb") as fobj:
+        return [
+            (
+                record.rec_type,
+                record.rec_headers.get_header("WARC-Target-URI"),
+                record.content_stream().read(),
+            )
+            for record in ArchiveIterator(fobj, check_digests="raise")
+        ]
+
+
+def test_part_filename():
+    assert part_filename("/tmp/a.warc.gz", 1) == "/tmp/a-00001.warc.gz"
+    assert part_filename("archive.warc", 12) == "archive-00012.warc"
+
+
+def test_merge_warcs(tmp_path):
+    first, second = str(tmp_path / "first.warc.gz"), str(tmp_path / "second.warc.gz")
+    create_warc(first, [("https://example.com/", 200, b"home")])
+    create_warc(
+        second,
+        [
+            ("https://example.com/copy", 200, b"home"),
+            ("https://example.com/error", 500, b"error"),
+            ("https://example.com/other", 200, b"other"),
+        ],
+    )
+    output = str(tmp_path / "merged.warc.gz")
+
+    stats, filenames = merge_warcs([first, second], output)
+    assert filenames == [output]
+    assert stats == {"records": 8, "revisits": 0, "dropped": 0}
+    assert read_records(output) == read_records(first) + read_records(second)
+
+    stats, filenames = merge_warcs(
+        [first, second], output, dedup=True, drop_failed=True, index=True
+    )
+    assert stats == {"records": 6, "revisits": 1, "dropped": 2}
+    assert [(rec_type, uri) for rec_type, uri, _ in read_records(output)] == [
+        ("request", "https://example.com/"),
+        ("response", "https://example.com/"),
+        ("request", "https://example.com/copy"),
+        ("revisit", "https://example.com/copy"),
+        ("request", "https://example.com/other"),
+        ("response", "https://example.com/other"),
+    ]
+    with open(f"{output}.index.jsonl") as fobj:
+        index = [json.loads(line) for line in fobj]
+    assert [entry["warc-type"] for entry in index] == [
+        "request",
+        "response",
+        "request",
+        "revisit",
+        "request",
+        "response",
+    ]
+    with open(output, mode="rb") as fobj:
+        for entry in index:
+            fobj.seek(entry["offset"])
+            record = next(ArchiveIterator(io.BytesIO(fobj.read(entry["length"]))))
+            assert record.rec_headers.get_header("WARC-Target-URI") == (
+                entry["warc-target-uri"]
+            )
+
+
+def test_merge_warcs_max_size(tmp_path):
+    filename = str(tmp_path / "input.warc.gz")
+    create_warc(
+        filename, [(f"https://example.com/{i}", 200, b"x" * 100) for i in range(10)]
+    )
+    output = str(tmp_path / "output.warc.gz")
+    stats, filenames = merge_warcs([filename], output, max_size=1000)
+    assert len(filenames) > 1
+    assert filenames[0] == str(tmp_path / "output-00001.warc.gz")
+    records = []
+    for part in filenames:
+        part_records = read_records(part)
+        # Requests are never split from their responses
+        assert [rec_type for rec_type, _, _ in part_records][::2] == (
+            ["request"] * (len(part_records) // 2)
+        )
+        records.extend(part_records)
+    assert records == read_records(filename)
+
+
+def test_guess_compression():
+    assert guess_compression("archive.warc.gz") == "gzip"
+    assert guess_compression("archive.WARC.ZST") == "zstd"
+    assert guess_compression("archive.warc") == "none"
+    assert guess_compression("archive.warc", default="gzip") == "gzip"
+
+
+def write_and_read(filename, **kwargs):
+    with open(filename, mode="wb") as fobj:
+        writer = WarcWriter(fobj, **kwargs)
+        for index in range(3):
+            writer.write_record(
+                writer.create_warc_record(
+                    f"https://example.com/{index}",
+                    "response",
+                    payload=io.BytesIO(b"<html>%d</html>" % index * 100),
+                    http_headers=StatusAndHeaders("200 OK", [], protocol="HTTP/1.1"),
+                )
+            )
+    records = [
+        (
+            record.rec_headers.get_header("WARC-Target-URI"),
+            record.content_stream().read(),
+        )
+        for record in iter_records([filename])
+    ]
+    assert records == [
+        (f"https://example.com/{index}", b"<html>%d</html>" % index * 100)
+        for index in range(3)
+    ]
+    assert WarcReader(filename).get_response("https://example.com/1") is not None
+
+
+def test_warc_writer_gzip_and_none(tmp_path):
+    write_and_read(str(tmp_path / "default.warc.gz"))
+    write_and_read(str(tmp_path / "fast.warc.gz"), compression="gzip", level=1)
+    write_and_read(str(tmp_path / "plain.warc"), compression="none")
+    with pytest.raises(ValueError):
+        WarcWriter(io.BytesIO(), compression="unknown")
+
+
+def test_check_compression_options():
+    check_compression_options("gzip", 1)
+    check_compression_options("zstd", 22, b"dictionary")
+    check_compression_options("none")
+    for compression, level, dictionary in (
+        ("gzip", 0, None),
+        ("gzip", 15, None),
+        ("zstd", 23, None),
+        ("none", 1, None),
+        ("gzip", None, b"dictionary"),
+        ("none", None, b"dictionary"),
+    ):
+        with pytest.raises(ValueError):
+            check_compression_options(compression, level, dictionary)
+        fobj = io.BytesIO()
+        with pytest.raises(ValueError):
+            WarcWriter(fobj, compression, level=level, dictionary=dictionary)
+        assert fobj.getvalue() == b""
+
+
+def test_warc_writer_zstd(tmp_path):
+    try:
+        zstd = import_zstd()
+    except RuntimeError:
+        pytest.skip("Zstandard is not available")
+    write_and_read(str(tmp_path / "default.warc.zst"), compression="zstd")
+    samples = [b"<html>%d</html>" % index * 10 for index in range(1000)]
+    dictionary = zstd.train_dict(samples, 1024).dict_content
+    filename = str(tmp_path / "dictionary.warc.zst")
+    write_and_read(filename, compression="zstd", level=19, dictionary=dictionary)
+    with open(filename, mode="rb") as fobj:  # Dictionary in a skippable frame
+        assert fobj.read(4) == b"\x5d\x2a\x4d\x18"
+
+
+def test_parse_digest():
+    digest = hashlib.sha1(b"crau").digest()
+    encoded = base64.b32encode(digest).decode("ascii")
+    assert parse_digest(f"sha1:{encoded}") == ("sha1", digest)
+    assert parse_digest(f"SHA-1:{digest.hex()}") == ("sha1", digest)
+    with pytest.raises(ValueError):
+        parse_digest("unknown:1234")
+    with pytest.raises(ValueError):
+        parse_digest("sha1:not base32")
+
+
+def test_create_digested_record(tmp_path):
+    filename = tmp_path / "payload.bin"
+    filename.write_bytes(b"file contents" * 1000)
+    output = str(tmp_path / "digested.warc.gz")
+    with open(output, mode="wb") as fobj, filename.open(mode="rb") as payload:
+        writer = WarcWriter(fobj)
+        for index, body in enumerate(
+            (b"bytes", payload, io.BufferedReader(io.BytesIO(b"stream" * 1000)))
+        ):
+            record = writer.create_digested_record(
+                f"https://example.com/{index}",
+                "response",
+                body,
+                http_headers=StatusAndHeaders("200 OK", [], protocol="HTTP/1.1"),
+            )
+            assert record.rec_headers.get_header("WARC-Block-Digest")
+            writer.write_record(record)
+        request_headers = StatusAndHeaders("GET / HTTP/1.1", [], is_http_request=True)
+        writer.write_record(
+            writer.create_digested_record(
+                "https://x.com/", "request", http_headers=request_headers
+            )
+        )
+    # Digests are checked while reading
+    assert [body for _, _, body in read_records(output)] == [
+        b"bytes",
+        b"file contents" * 1000,
+        b"stream" * 1000,
+        b"",
+    ]
+    assert all(not errors for *_, errors in verify_warcs([output]))
+
+
+def test_verify_warcs(tmp_path):
+    filename = str(tmp_path / "archive.warc")
+    with open(filename, mode="wb") as fobj:
+        writer = WarcWriter(fobj, compression="none")
+        for url, body in (
+            ("https://example.com/", b"good"),
+            ("https://x.com/", b"bad"),
+        ):
+            writer.write_record(
+                writer.create_digested_record(
+                    url,
+                    "response",
+                    body,
+                    http_headers=StatusAndHeaders("200 OK", [], protocol="HTTP/1.1"),
+                )
+            )
+    with open(filename, mode="r+b") as fobj:
+        data = fobj.read()
+        fobj.seek(data.rindex(b"bad"))
+        fobj.write(b"BAD")
+
+    results = list(verify_warcs([filename], jobs=2))
+    assert [(uri, errors) for _, _, _, uri, errors in results] == [
+        ("https://example.com/", []),
+        ("https://x.com/", ["WARC-Block-Digest", "WARC-Payload-Digest"]),
+    ]
+    assert results[0][1] == 0 and results[1][1] > 0